@@ -1,13 +1,15 @@
-from fastapi import FastAPI, UploadFile, File, Body, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Body, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import boto3, uuid, json, time, asyncio
 from typing import Optional, List
 from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
-from settings import settings
-from inference import get_vlm
+from settings import settings, TIER_NAMES
 from websocket_manager import ws_manager, send_job_update
+from job_state import job_status
+from sharding import split_job
+from manifest import INDEXED_STATUSES, index_info, list_readable_parts, manifest_key, read_page, read_part
 import io
 
 # Optimized AWS configuration with connection pooling
@@ -21,8 +23,10 @@ aws_config = Config(
 sqs = boto3.client("sqs", region_name=settings.aws_region, config=aws_config)
 s3 = boto3.client("s3", region_name=settings.aws_region, config=aws_config)
 
-# Global VLM instance - load once at startup
-vlm_instance = None
+# Previews go to the worker's inference service over HTTP (httpx client), or, when
+# settings.inference_service_url is empty, to a model loaded in this process
+inference_client = None
+local_service = None  # inference_service module, imported only in local mode
 upload_executor = ThreadPoolExecutor(max_workers=10)  # For parallel S3 uploads
 
 app = FastAPI(title="Renamer AI API")
@@ -41,32 +45,63 @@ def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize VLM model at startup for optimal performance"""
-    global vlm_instance
+    """Connect to the inference service, or start loading the model in-process when none is configured"""
+    global inference_client, local_service
     import os
     
+    # Live job updates from workers and other replicas, forwarded to this replica's WebSockets
+    ws_manager.start_listener()
+    
+    if settings.inference_service_url:
+        import httpx
+        inference_client = httpx.AsyncClient(
+            base_url=settings.inference_service_url,
+            timeout=settings.inference_service_timeout_seconds
+        )
+        print(f"🛰️ Delegating previews to inference service at {settings.inference_service_url}")
+        return
+    
     # Check if model loading should be skipped
     if os.getenv("SKIP_MODEL_LOAD", "").lower() in ("true", "1"):
         print("⚠️ Skipping VLM model loading (SKIP_MODEL_LOAD=true)")
-        vlm_instance = None
         return
-        
-    print("🤖 Loading VLM model at startup...")
-    try:
-        vlm_instance = get_vlm()
-        print("✅ VLM model loaded successfully - API ready!")
-    except Exception as e:
-        print(f"❌ Failed to load VLM model: {e}")
-        print("⚠️ API starting without VLM model - inference will fail")
-        print("💡 Consider using a larger instance type or enabling SKIP_MODEL_LOAD=true")
-        vlm_instance = None
+    
+    # Local mode: torch and the model are only imported here; /health answers 503 while they load
+    import inference_service
+    local_service = inference_service
+    await local_service.start_loading()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup resources on shutdown"""
+    await ws_manager.stop_listener()
+    if inference_client is not None:
+        await inference_client.aclose()
+    if local_service is not None:
+        await local_service.stop()
     upload_executor.shutdown(wait=True)
     print("🛑 API shutdown complete")
 
+async def remote_preview(image_bytes: bytes, filename: str, prompt: str, tier: Optional[str]) -> dict:
+    """Forward a preview to the inference service, passing its errors through"""
+    import httpx
+    try:
+        response = await inference_client.post(
+            "/v1/preview",
+            files={"file": (filename or "image", image_bytes)},
+            data={"prompt": prompt, "tier": tier or ""}
+        )
+    except httpx.HTTPError as e:
+        print(f"❌ Inference service unreachable: {e}")
+        raise HTTPException(status_code=503, detail="Inference service unavailable, please retry")
+    if response.status_code != 200:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise HTTPException(status_code=response.status_code, detail=detail)
+    return response.json()
+
 def upload_single_file(file_content: bytes, filename: str, job_id: str, index: int) -> str:
     """Upload a single file to S3 (synchronous for thread pool)"""
     file_key = f"demo/{job_id}/{index:03d}_{filename}"
@@ -78,6 +113,17 @@ def upload_single_file(file_content: bytes, filename: str, job_id: str, index: i
     )
     return file_key
 
+def enqueue_shards(messages: List[dict]):
+    """Send shard messages in SQS batches of 10"""
+    for start in range(0, len(messages), 10):
+        chunk = messages[start:start + 10]
+        response = sqs.send_message_batch(
+            QueueUrl=settings.sqs_queue_url,
+            Entries=[{"Id": str(start + i), "MessageBody": json.dumps(m)} for i, m in enumerate(chunk)]
+        )
+        if response.get("Failed"):
+            raise RuntimeError(f"Failed to enqueue shards: {response['Failed']}")
+
 async def upload_files_parallel(files: List[UploadFile], job_id: str) -> List[str]:
     """Upload multiple files to S3 in parallel"""
     print(f"📤 Uploading {len(files)} files in parallel...")
@@ -102,17 +148,54 @@ async def upload_files_parallel(files: List[UploadFile], job_id: str) -> List[st
     print(f"✅ All {len(files)} files uploaded successfully")
     return file_keys
 
-@app.get("/health")
-async def health():
-    """Health check with VLM status"""
-    vlm_ready = vlm_instance is not None
-    return {
-        "status": "ok", 
+async def preview_health() -> tuple:
+    """(HTTP status, body) of whatever serves previews: 503 until it can"""
+    if inference_client is not None:
+        try:
+            response = await inference_client.get("/health", timeout=5)
+            body = response.json()
+            status_code = response.status_code
+        except Exception as e:
+            body = {"status": "inference_unavailable", "timestamp": time.time(), "error": str(e)}
+            status_code = 503
+        body["inference_service"] = settings.inference_service_url
+        return status_code, body
+    if local_service is not None:
+        return local_service.health_report()
+    return 503, {
+        "status": "unavailable",
         "timestamp": time.time(),
-        "vlm_ready": vlm_ready,
-        "model_loaded": vlm_ready
+        "model_state": "skipped",
+        "vlm_ready": False,
+        "model_loaded": False
     }
 
+@app.get("/health")
+async def health():
+    """Health check with VLM status.
+
+    With a separate inference service this is API liveness only (jobs, results and
+    WebSockets don't need the model), and preview readiness is reported as a field;
+    with the model in this process it answers 503 while the model loads or warms up.
+    """
+    status_code, body = await preview_health()
+    if inference_client is not None:
+        return {
+            "status": "ok",
+            "timestamp": time.time(),
+            "preview_ready": status_code == 200,
+            "preview": body
+        }
+    if local_service is not None:
+        return JSONResponse(status_code=status_code, content=body)
+    return {**body, "status": "ok"}
+
+@app.get("/health/preview")
+async def health_preview():
+    """Readiness of /v1/preview: 503 until the model serving it is loaded and warmed up"""
+    status_code, body = await preview_health()
+    return JSONResponse(status_code=status_code, content=body)
+
 @app.get("/debug/test")
 async def debug_test():
     """Simple test endpoint to verify code updates are working"""
@@ -127,43 +210,29 @@ async def debug_test():
     }
 
 @app.post("/v1/preview")
-async def preview_rename(file: UploadFile = File(...), prompt: str = Body("", embed=True), api_key: str = Depends(verify_api_key)):
-    """Fast preview endpoint with pre-loaded model"""
-    print(f"🔍 PREVIEW ENDPOINT called with file: {file.filename}, prompt: {repr(prompt)}")
-    try:
-        # Check if model is ready
-        if vlm_instance is None:
-            print("❌ VLM instance is None")
-            raise HTTPException(status_code=503, detail="Model not ready yet, please wait")
-        
-        print(f"🔍 VLM instance ready, id: {id(vlm_instance)}")
-        
-        # Read file
-        image_bytes = await file.read()
-        print(f"🔍 Image read, size: {len(image_bytes)} bytes")
-        
-        # Process with pre-loaded model (much faster!)
-        start_time = time.time()
-        print(f"🔍 Calling vlm_instance.predict_single...")
-        suggested_name = vlm_instance.predict_single(image_bytes, prompt)
-        processing_time = time.time() - start_time
-        
-        print(f"🔍 PREVIEW ENDPOINT returning: {repr(suggested_name)}")
-        
-        return {
-            "original": file.filename,
-            "suggested": suggested_name,
-            "processing_time_ms": int(processing_time * 1000)
-        }
-    except Exception as e:
-        print(f"❌ PREVIEW ENDPOINT error: {e}")
-        raise HTTPException(status_code=400, detail=f"Preview failed: {str(e)}")
+async def preview_rename(file: UploadFile = File(...), prompt: str = Body("", embed=True),
+                         tier: Optional[str] = Body(None, embed=True), api_key: str = Depends(verify_api_key)):
+    """Fast preview endpoint, served by the inference service's pre-loaded model"""
+    print(f"🔍 PREVIEW ENDPOINT called with file: {file.filename}, prompt: {repr(prompt)}, tier: {tier}")
+    image_bytes = await file.read()
+    if inference_client is not None:
+        result = await remote_preview(image_bytes, file.filename, prompt, tier)
+    elif local_service is not None:
+        result = await local_service.preview(image_bytes, prompt, tier)
+    else:
+        raise HTTPException(status_code=503, detail="Model not loaded (SKIP_MODEL_LOAD=true)")
+    print(f"🔍 PREVIEW ENDPOINT returning: {repr(result['suggested'])}")
+    return {"original": file.filename, **result}
 
 @app.post("/v1/jobs/rename")
-async def create_job(user_prompt: str = Body("", embed=True), files: list[UploadFile] = File(default=[]), api_key: str = Depends(verify_api_key)):
+async def create_job(user_prompt: str = Body("", embed=True), files: list[UploadFile] = File(default=[]),
+                     tier: Optional[str] = Body(None, embed=True), api_key: str = Depends(verify_api_key)):
     """Create rename job with parallel S3 uploads"""
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
+    tier = tier or settings.default_tier
+    if tier not in TIER_NAMES:
+        raise HTTPException(status_code=400, detail=f"Unknown tier '{tier}' (expected one of: {', '.join(TIER_NAMES)})")
     
     job_id = f"jr_{uuid.uuid4().hex[:8]}"
     
@@ -180,14 +249,22 @@ async def create_job(user_prompt: str = Body("", embed=True), files: list[Upload
             "job_id": job_id,
             "file_keys": file_keys,
             "user_prompt": user_prompt,
+            "tier": tier,
             "total_files": len(files)
         }
         
-        # Send to SQS queue
-        sqs.send_message(
-            QueueUrl=settings.sqs_queue_url,
-            MessageBody=json.dumps(job_message)
-        )
+        # Send to SQS queue, one message per shard so large jobs spread across workers
+        messages = split_job(job_message, settings.job_shard_size)
+        # Status record first, so a worker picking the job up at once finds it to update
+        await job_status.create(job_id, len(files), tier, len(messages))
+        if len(messages) == 1:
+            sqs.send_message(
+                QueueUrl=settings.sqs_queue_url,
+                MessageBody=json.dumps(job_message)
+            )
+        else:
+            await asyncio.get_event_loop().run_in_executor(upload_executor, enqueue_shards, messages)
+            print(f"🧩 Job {job_id} split into {len(messages)} shards")
         
         # Send initial WebSocket update
         await send_job_update(job_id, "job_started", {
@@ -201,6 +278,7 @@ async def create_job(user_prompt: str = Body("", embed=True), files: list[Upload
             "job_id": job_id,
             "status": "queued",
             "file_count": len(files),
+            "shards": len(messages),
             "upload_time_ms": int(upload_time * 1000)
         }
         
@@ -227,9 +305,31 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
 
 @app.get("/v1/jobs/{job_id}/progress")
 async def get_job_progress(job_id: str):
-    """Polling fallback for clients without WebSocket support"""
-    history = await ws_manager.get_job_history(job_id, limit=10)
+    """Polling fallback for clients without WebSocket support: one read of the job's status record"""
+    status = await job_status.get(job_id)
+    if status is None:
+        return legacy_job_progress(job_id, await ws_manager.get_job_history(job_id, limit=10))
     
+    total = status.get("total", 0)
+    # "completed" counts every finished item (errors included), as progress always has
+    completed = min(total, status.get("succeeded", 0) + status.get("errors", 0))
+    return {
+        "job_id": job_id,
+        "state": status.get("state"),
+        "completed": completed,
+        "succeeded": status.get("succeeded", 0),
+        "errors": status.get("errors", 0),
+        "total": total,
+        "tier": status.get("tier"),
+        "shards": status.get("shards", 1),
+        "latest_results": status["latest_results"],
+        "progress_percent": (completed / total * 100) if total > 0 else 0,
+        "timings": {key: status[key] for key in ("created_at", "started_at", "updated_at", "finished_at") if key in status},
+        "error": status.get("error")
+    }
+
+def legacy_job_progress(job_id: str, history: list) -> dict:
+    """Progress recomputed from recent update history, for jobs without a status record"""
     # Calculate current progress from history
     completed = 0
     total = 0
@@ -251,18 +351,69 @@ async def get_job_progress(job_id: str):
     }
 
 @app.get("/v1/jobs/{job_id}/results")
-async def get_job_results(job_id: str):
-    """Get job results with streaming for large datasets"""
+async def get_job_results(job_id: str, request: Request, offset: int = 0, limit: Optional[int] = None,
+                          status: Optional[str] = None, after: Optional[str] = None):
+    """Get job results. With offset/limit/status, finished jobs are paged through the
+    manifest's line-offset index with ranged reads (ETag / If-None-Match supported);
+    without them the whole manifest is returned (streamed when large). While the job
+    runs, pages through the items finished so far (pass ``next_cursor`` back as ``after``);
+    offset and status need a finished job and answer 409 until then"""
+    if status is not None and status not in INDEXED_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown status '{status}' (expected one of: {', '.join(INDEXED_STATUSES)})")
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    loop = asyncio.get_event_loop()
+    
+    if limit is not None or offset or status is not None:
+        try:
+            info = await loop.run_in_executor(upload_executor, index_info, s3, job_id, status)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to get results: {str(e)}")
+        if info is not None:
+            limit = min(limit or settings.results_page_size, settings.results_max_page_size)
+            # Indexes are written once per finished manifest, so their ETag identifies every page of it
+            etag = f'W/"{info["etag"]}-{status or "all"}-{offset}-{limit}"'
+            if etag in request.headers.get("if-none-match", ""):
+                return Response(status_code=304, headers={"ETag": etag})
+            try:
+                results = await loop.run_in_executor(
+                    upload_executor, read_page, s3, job_id, offset, limit, status, info["total"]
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to get results: {str(e)}")
+            next_offset = offset + len(results)
+            return JSONResponse(content={
+                "job_id": job_id,
+                "status": "completed",
+                "results": results,
+                "total_results": info["total"],
+                "offset": offset,
+                "limit": limit,
+                "next_offset": next_offset if next_offset < info["total"] else None
+            }, headers={"ETag": etag})
+    
     try:
         # Check if results exist in S3
         response = s3.get_object(
             Bucket=settings.s3_out_bucket,
-            Key=f"demo/jobs/{job_id}/manifest.jsonl"
+            Key=manifest_key(job_id)
         )
+        etag = response.get("ETag")
+        if etag and etag in request.headers.get("if-none-match", ""):
+            response['Body'].close()
+            return Response(status_code=304, headers={"ETag": etag})
         
         # Get content length for small files
         content_length = response.get('ContentLength', 0)
         
+        # Paged request for a manifest without an index (written before indexes existed)
+        if limit is not None or offset or status is not None:
+            return StreamingResponse(
+                stream_job_results(job_id, response['Body'], offset, limit, status),
+                media_type="application/json",
+                headers={"X-Job-ID": job_id, "X-Content-Type": "streaming"}
+            )
+        
         # For small files (< 1MB), return directly
         if content_length < 1024 * 1024:  # 1MB threshold
             manifest_content = response['Body'].read().decode('utf-8')
@@ -271,12 +422,12 @@ async def get_job_results(job_id: str):
                 if line:
                     results.append(json.loads(line))
             
-            return {
+            return JSONResponse(content={
                 "job_id": job_id,
                 "status": "completed",
                 "results": results,
                 "total_results": len(results)
-            }
+            }, headers={"ETag": etag} if etag else None)
         else:
             # For large files, use streaming response
             return StreamingResponse(
@@ -284,46 +435,78 @@ async def get_job_results(job_id: str):
                 media_type="application/json",
                 headers={
                     "X-Job-ID": job_id,
-                    "X-Content-Type": "streaming"
+                    "X-Content-Type": "streaming",
+                    **({"ETag": etag} if etag else {})
                 }
             )
             
     except s3.exceptions.NoSuchKey:
-        return {
-            "job_id": job_id,
-            "status": "processing",
-            "results": []
-        }
+        if offset or status is not None:
+            # Partial results are in write order without an index: only cursor paging applies
+            raise HTTPException(status_code=409, detail="offset and status need a finished job; "
+                                                        "page a running job's results with after=next_cursor")
+        try:
+            return await loop.run_in_executor(
+                upload_executor, partial_results, job_id, after, limit or settings.results_page_size
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to get partial results: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get results: {str(e)}")
 
-async def stream_job_results(job_id: str, s3_body):
-    """Stream large job results to avoid memory issues"""
+def partial_results(job_id: str, after: Optional[str], limit: int) -> dict:
+    """Finished items of a running job from its manifest parts, in write order.
+
+    Reads whole parts until at least ``limit`` items, stopping before a part that is still
+    being uploaded so the cursor never skips it; an item retried by a redelivered job can
+    appear twice (same ``index``), and names are only deduplicated across shards in the
+    final manifest.
+    """
+    results = []
+    cursor = after
+    keys = list_readable_parts(s3, job_id, after=after, limit=max(1, limit // max(1, settings.manifest_part_size)) + 1)
+    for key in keys:
+        if len(results) >= limit:
+            break
+        results.extend(read_part(s3, key))
+        cursor = key.rsplit("/", 1)[-1]
+    return {
+        "job_id": job_id,
+        "status": "processing",
+        "results": results,
+        "total_results": len(results),
+        "next_cursor": cursor
+    }
+
+async def stream_job_results(job_id: str, s3_body, offset: int = 0, limit: Optional[int] = None,
+                             status: Optional[str] = None):
+    """Stream large job results line by line to avoid memory issues, optionally
+    skipping ``offset`` matching lines and stopping after ``limit``"""
     try:
         # Start JSON response
         yield '{"job_id": "' + job_id + '", "status": "completed", "results": ['
         
         first_item = True
-        buffer = ""
-        
-        # Stream and parse line by line
-        for chunk in s3_body.iter_chunks(chunk_size=8192):
-            buffer += chunk.decode('utf-8')
-            
-            # Process complete lines
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                if line.strip():
-                    if not first_item:
-                        yield ','
-                    yield line.strip()
-                    first_item = False
+        matched = 0
+        emitted = 0
         
-        # Process remaining buffer
-        if buffer.strip():
+        # botocore splits the body into lines without re-concatenating the whole buffer
+        for raw in s3_body.iter_lines(chunk_size=8192):
+            line = raw.decode('utf-8').strip()
+            if not line:
+                continue
+            if status is not None and json.loads(line).get("status") != status:
+                continue
+            matched += 1
+            if matched <= offset:
+                continue
+            if limit is not None and emitted >= limit:
+                break
             if not first_item:
                 yield ','
-            yield buffer.strip()
+            yield line
+            first_item = False
+            emitted += 1
         
         # Close JSON
         yield ']}'
@@ -331,6 +514,8 @@ async def stream_job_results(job_id: str, s3_body):
     except Exception as e:
         # Stream error response
         yield f'{{"error": "Streaming failed: {str(e)}"}}'
+    finally:
+        s3_body.close()
 
 @app.get("/v1/jobs/{job_id}/results/stream")
 async def stream_job_results_endpoint(job_id: str):
@@ -338,7 +523,7 @@ async def stream_job_results_endpoint(job_id: str):
     try:
         response = s3.get_object(
             Bucket=settings.s3_out_bucket,
-            Key=f"demo/jobs/{job_id}/manifest.jsonl"
+            Key=manifest_key(job_id)
         )
         
         return StreamingResponse(
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import torch
+from PIL import Image
+from settings import settings
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _cpu_available_bytes() -> int:
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class _RSSPeakSampler:
+    """Background sampler tracking peak RSS while a CPU batch runs"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+class BatchAutotuner:
+    """Chooses batch sizes from measured peak memory instead of a per-image guess.
+
+    ``calibrate`` runs worst-case (max_pixels) batches of increasing size, measures peak
+    GPU memory (or process RSS on CPU) for each, fits fixed + per-image cost and
+    persists the profile to ``autotune_profile_path`` keyed by model, quantization,
+    max_pixels and device. OOMs seen in production lower a learned ceiling, which is
+    persisted too; after ``autotune_ceiling_probe_batches`` successful batches at the
+    ceiling it is raised by one, so a transient OOM does not pin batch sizes low.
+    Recalibrating clears it.
+    """
+
+    def __init__(self, vlm):
+        self.vlm = vlm
+        self.use_cuda = torch.cuda.is_available()
+        self.key = self._profile_key()
+        self.profile: Optional[Dict] = self._load().get(self.key)
+        self.last_batch_size: Optional[int] = None
+        # Successful batches at the OOM ceiling since it last moved
+        self.ceiling_successes = 0
+
+    def _profile_key(self) -> str:
+        device = torch.cuda.get_device_name(0) if self.use_cuda else "cpu"
+        model_id = getattr(self.vlm, "model_id", settings.model_id)
+        quantization = getattr(self.vlm, "quantization", settings.quantization)
+        return f"{model_id}|{quantization}|{settings.max_pixels}|{device}"
+
+    def _load(self) -> Dict:
+        try:
+            with open(settings.autotune_profile_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        profiles = self._load()
+        profiles[self.key] = self.profile
+        os.makedirs(os.path.dirname(os.path.abspath(settings.autotune_profile_path)), exist_ok=True)
+        tmp_path = settings.autotune_profile_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(tmp_path, settings.autotune_profile_path)
+
+    def _available_bytes(self) -> int:
+        if self.use_cuda:
+            free, _ = torch.cuda.mem_get_info()
+            return free
+        return _cpu_available_bytes()
+
+    def _measure(self, batch_size: int) -> int:
+        """Peak memory above baseline for one worst-case batch"""
+        side = int(settings.max_pixels ** 0.5)
+        imgs = [Image.new("RGB", (side, side), (127, 127, 127)) for _ in range(batch_size)]
+        prompts = [""] * batch_size
+
+        if self.use_cuda:
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+            baseline = torch.cuda.memory_allocated()
+            with torch.inference_mode():
+                self.vlm._generate_batch(imgs, prompts)
+            torch.cuda.synchronize()
+            return torch.cuda.max_memory_allocated() - baseline
+
+        with _RSSPeakSampler() as sampler:
+            baseline = sampler.peak
+            with torch.inference_mode():
+                self.vlm._generate_batch(imgs, prompts)
+        return sampler.peak - baseline
+
+    def calibrate(self, sizes: Optional[List[int]] = None) -> Dict:
+        """Measure peak memory per batch size and persist the fitted profile"""
+        if sizes is None:
+            sizes, n = [], 1
+            max_batch_size = self._max_batch_size()
+            while n < max_batch_size:
+                sizes.append(n)
+                n *= 2
+            sizes.append(max_batch_size)
+
+        measured = {}
+        for size in sizes:
+            try:
+                measured[size] = self._measure(size)
+                print(f"📏 Batch size {size}: peak {measured[size] / 2**20:.0f}MB")
+            except torch.cuda.OutOfMemoryError:
+                print(f"⚠️ Batch size {size} OOM during calibration")
+                torch.cuda.empty_cache()
+                break
+
+        if not measured:
+            raise RuntimeError("Autotune calibration failed: no batch size fit in memory")
+
+        # Least-squares fit of peak = fixed + per_image * n
+        xs, ys = list(measured.keys()), list(measured.values())
+        if len(xs) > 1:
+            mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+            var_x = sum((x - mean_x) ** 2 for x in xs)
+            per_image = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+            fixed = mean_y - per_image * mean_x
+        else:
+            per_image, fixed = ys[0], 0
+
+        self.profile = {
+            "per_image_bytes": max(1, int(per_image)),
+            "fixed_bytes": max(0, int(fixed)),
+            "measured_peak_bytes": {str(k): v for k, v in measured.items()},
+            "max_ok_batch_size": max(measured),
+            "oom_ceiling": None,
+            "calibrated_at": time.time()
+        }
+        self.ceiling_successes = 0
+        self._save()
+        print(f"✅ Autotune profile saved: {self.profile['per_image_bytes'] / 2**20:.1f}MB/image")
+        return self.profile
+
+    def batch_size(self, num_images: int) -> int:
+        """Largest batch expected to fit in currently free memory"""
+        cap = min(self._max_batch_size(), max(1, num_images))
+        if self.profile:
+            if self.profile.get("oom_ceiling"):
+                cap = min(cap, self.profile["oom_ceiling"])
+            available = self._available_bytes() * settings.autotune_memory_fraction
+            fits = int((available - self.profile["fixed_bytes"]) / self.profile["per_image_bytes"])
+            size = max(1, min(cap, fits))
+        elif self.use_cuda:
+            # Uncalibrated: conservative 50MB-per-image estimate on 70% of free memory
+            size = max(1, min(cap, int(self._available_bytes() * 0.7 / (50 * 1024 * 1024))))
+        else:
+            size = cap
+        self.last_batch_size = size
+        return size
+
+    def _max_batch_size(self) -> int:
+        return settings.max_batch_size if self.use_cuda else settings.cpu_max_batch_size
+
+    def record_oom(self, batch_size: int, persist: bool = True):
+        """Lower the ceiling below a batch size that just ran out of memory; ``persist=False``
+        keeps it to this process (warmup, where other work may be holding memory)"""
+        ceiling = max(1, batch_size - 1)
+        if self.profile is None:
+            self.profile = {"per_image_bytes": 50 * 1024 * 1024, "fixed_bytes": 0, "measured_peak_bytes": {}}
+        self.ceiling_successes = 0
+        if not self.profile.get("oom_ceiling") or ceiling < self.profile["oom_ceiling"]:
+            self.profile["oom_ceiling"] = ceiling
+            print(f"⚠️ OOM at batch size {batch_size}, ceiling lowered to {ceiling}")
+            if persist:
+                self._persist()
+
+    def record_success(self, batch_size: int):
+        """Count a batch that fit; enough of them at the ceiling raise it by one"""
+        ceiling = self.profile.get("oom_ceiling") if self.profile else None
+        if not ceiling or batch_size < ceiling:
+            return
+        self.ceiling_successes += 1
+        if self.ceiling_successes < settings.autotune_ceiling_probe_batches:
+            return
+        self.ceiling_successes = 0
+        raised = ceiling + 1
+        self.profile["oom_ceiling"] = raised if raised < self._max_batch_size() else None
+        print(f"📈 {settings.autotune_ceiling_probe_batches} batches fit at the OOM ceiling, raised to "
+              f"{self.profile['oom_ceiling'] or 'none'}")
+        self._persist()
+
+    def _persist(self):
+        try:
+            self._save()
+        except OSError as e:
+            print(f"⚠️ Failed to persist autotune profile: {e}")
+
+    def report(self) -> Dict:
+        return {
+            "profile_key": self.key,
+            "calibrated": bool(self.profile and self.profile.get("measured_peak_bytes")),
+            "per_image_mb": (self.profile["per_image_bytes"] / 2**20) if self.profile else None,
+            "oom_ceiling": self.profile.get("oom_ceiling") if self.profile else None,
+            "last_batch_size": self.last_batch_size
+        }
+
+
+if __name__ == "__main__":
+    # One-off calibration: python3 autotune.py
+    from inference import get_vlm
+    tuner = get_vlm().autotuner
+    print(json.dumps(tuner.calibrate(), indent=2))
@@ -0,0 +1,409 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional
+from PIL import Image
+import torch
+from settings import settings
+from cache import MemoryLRUBackend, content_hash, create_result_cache
+from autotune import BatchAutotuner
+from imaging import ProcessDecoder, decode_image, decode_stats
+
+
+def _image_nbytes(im: Image.Image) -> int:
+    """Approximate decoded size of an image from its dimensions and bands"""
+    return im.width * im.height * len(im.getbands())
+
+
+class StartupTimer:
+    """Wall-clock seconds per model startup phase (import, weight load, quantize, warmup, ...)"""
+
+    def __init__(self, initial: Optional[dict] = None):
+        self.phases = dict(initial or {})
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        return {
+            **{name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "total": round(sum(self.phases.values()), 3)
+        }
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.phases.items())
+
+
+class ThroughputStats:
+    """Images generated and model time spent, for comparing tiers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def record(self, images: int, seconds: float):
+        with self._lock:
+            self.images += images
+            self.batches += 1
+            self.seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "images": self.images,
+                "batches": self.batches,
+                "seconds": round(self.seconds, 3),
+                "images_per_second": (self.images / self.seconds) if self.seconds else None
+            }
+
+
+class VisionBackend:
+    """Model-independent half of a naming backend (one per tier).
+
+    Owns image decoding, the decoded-image and result caches, batch planning, OOM
+    bisection and throughput stats. Subclasses load a model and implement
+    ``_generate_batch``, returning names already passed through ``to_kebab``; callers
+    (pipeline, scheduler, API) only use the methods defined here.
+    """
+
+    tier = "quality"
+
+    # Model-specific accelerators, set by subclasses that have them (reported by /health)
+    vision_cache = None
+    prefix_cache = None
+    speculative = None
+
+    def __init__(self, model_id: str, quantization: Optional[str] = None):
+        self.model_id = model_id
+        self.quantization = quantization
+
+        # Optional process pool so GIL-bound decoding scales across cores
+        self.process_decoder = None
+        preprocess_threads = settings.parallel_downloads
+        if settings.decode_mode == "process":
+            decode_processes = settings.decode_processes or os.cpu_count()
+            self.process_decoder = ProcessDecoder(decode_processes)
+            # Threads only dispatch to the pool, so keep one per decode process
+            preprocess_threads = max(preprocess_threads, decode_processes)
+
+        # Fixed thread pool for parallel image preprocessing
+        self.thread_pool = ThreadPoolExecutor(max_workers=preprocess_threads)
+
+        # Decoded-image cache: true LRU bounded by the decoded pixel bytes it holds
+        self.image_cache = MemoryLRUBackend(max_bytes=settings.image_cache_max_bytes, sizeof=_image_nbytes)
+
+        # Suggested-name cache keyed by image content, prompt and model config
+        self.result_cache = create_result_cache(model_id, quantization)
+
+        self.throughput = ThroughputStats()
+
+        # The worker's jobs and the inference service's previews share one model in one process
+        self.generate_lock = threading.Lock()
+
+        # Set once warmup has run (or immediately when it is disabled)
+        self.ready = not settings.startup_warmup
+        self.warmup_report: Optional[dict] = None
+
+        # Batch sizes from measured peak memory (python3 autotune.py to calibrate)
+        self.autotuner = BatchAutotuner(self)
+        if settings.autotune_on_startup and not self.autotuner.report()["calibrated"]:
+            self.autotuner.calibrate()
+
+    def warmup_batch_sizes(self) -> List[int]:
+        """Batch sizes traffic will actually use: settings.warmup_batch_sizes, else
+        single previews, a full preview micro-batch and the autotuned job batch"""
+        if settings.warmup_batch_sizes:
+            return sorted({int(size) for size in settings.warmup_batch_sizes.split(",") if size.strip()})
+        job_batch = self._get_dynamic_batch_size(settings.max_batch_size)
+        return sorted({1, min(settings.scheduler_max_batch_size, job_batch), job_batch})
+
+    @torch.inference_mode()
+    def warmup(self, batch_sizes: Optional[List[int]] = None) -> dict:
+        """Run dummy worst-case batches so kernel selection, allocator growth and processor
+        setup happen before the first real request; marks the backend ready"""
+        batch_sizes = batch_sizes or self.warmup_batch_sizes()
+        start = time.perf_counter()
+
+        # Exercise the decode path (codec init, process pool spawn) with a tiny JPEG
+        bio = io.BytesIO()
+        Image.new("RGB", (64, 64), (127, 127, 127)).save(bio, "JPEG")
+        self.preprocess_img(bio.getvalue())
+
+        side = int(settings.max_pixels ** 0.5)
+        latency_ms = {}
+        for size in batch_sizes:
+            imgs = [Image.new("RGB", (side, side), (127, 127, 127)) for _ in range(size)]
+            batch_start = time.perf_counter()
+            try:
+                self._generate_batch(imgs, [""] * size)
+            except torch.cuda.OutOfMemoryError:
+                # Larger sizes would fail too; real traffic is bisected below this size
+                torch.cuda.empty_cache()
+                # Not persisted: warmup may share the GPU with work that is about to finish
+                self.autotuner.record_oom(size, persist=False)
+                print(f"⚠️ Warmup OOM at batch size {size}, skipping larger sizes")
+                break
+            latency_ms[size] = round((time.perf_counter() - batch_start) * 1000, 1)
+            print(f"🔥 Warmup batch size {size}: {latency_ms[size]:.0f}ms")
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.warmup_report = {
+            "batch_sizes": batch_sizes,
+            "latency_ms": latency_ms,
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        self.ready = True
+        return self.warmup_report
+
+    def cached_result(self, image_hash: str, user_prompt: str):
+        """Look up a previously generated name for this image and prompt"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(image_hash, user_prompt)
+
+    def _store_results(self, image_hashes: List[str], prompts: List[str], names: List[str]):
+        if self.result_cache is None:
+            return
+        for image_hash, prompt, name in zip(image_hashes, prompts, names):
+            if image_hash:
+                self.result_cache.set(image_hash, prompt, name)
+
+    def decode_stats(self) -> dict:
+        """Per-format decode counts and timings"""
+        return decode_stats.as_dict()
+
+    def image_cache_stats(self) -> dict:
+        """Decoded-image cache statistics for sizing it against worker RAM"""
+        return {
+            **self.image_cache.stats.as_dict(),
+            "entries": len(self.image_cache),
+            "bytes": self.image_cache.current_bytes,
+            "max_bytes": self.image_cache.max_bytes
+        }
+
+    def preprocess_img(self, b: bytes, image_hash: Optional[str] = None, copy: bool = False) -> Image.Image:
+        """Memory-optimized image preprocessing with caching.
+
+        Cache hits return the shared cached image; it must be treated as read-only
+        unless ``copy=True`` is passed.
+        """
+        # Check cache first
+        img_hash = image_hash or content_hash(b)
+        cached_img = self.image_cache.get(img_hash)
+        if cached_img is not None:
+            return cached_img.copy() if copy else cached_img
+
+        # Sniffed, reduced-resolution decode straight to the target size
+        if self.process_decoder is not None:
+            im = self.process_decoder.decode(b, settings.max_pixels)
+        else:
+            im = decode_image(b, settings.max_pixels)
+
+        # Cache the processed image
+        self.image_cache.set(img_hash, im)
+
+        return im
+
+    def _get_dynamic_batch_size(self, num_images: int) -> int:
+        """Calculate optimal batch size from the measured memory profile"""
+        try:
+            return self.autotuner.batch_size(num_images)
+        except Exception as e:
+            print(f"⚠️ Autotuner failed ({e}), using conservative batch size")
+            return min(2, settings.max_batch_size, num_images)
+
+    def _generate_batch(self, batch_imgs: List[Image.Image], prompts: List[str],
+                        image_hashes: Optional[List[str]] = None) -> List[str]:
+        """Run a single batched generate call over preprocessed images"""
+        raise NotImplementedError
+
+    def _generate_bisect(self, imgs: List[Image.Image], prompts: List[str],
+                         image_hashes: Optional[List[str]] = None) -> List[str]:
+        """Generate a batch, halving it recursively on OOM instead of dropping to one-by-one"""
+        try:
+            names = self._generate_batch(imgs, prompts, image_hashes)
+        except torch.cuda.OutOfMemoryError:
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            self.autotuner.record_oom(len(imgs))
+            if len(imgs) == 1:
+                raise
+            mid = len(imgs) // 2
+            print(f"⚠️ GPU OOM at batch size {len(imgs)}, retrying as {mid} + {len(imgs) - mid}")
+            hashes = image_hashes or [None] * len(imgs)
+            return (self._generate_bisect(imgs[:mid], prompts[:mid], hashes[:mid])
+                    + self._generate_bisect(imgs[mid:], prompts[mid:], hashes[mid:]))
+        self.autotuner.record_success(len(imgs))
+        return names
+
+    def _generate_timed(self, imgs: List[Image.Image], prompts: List[str],
+                        image_hashes: Optional[List[str]] = None) -> List[str]:
+        """``_generate_bisect`` serialized on the model, with the time recorded in this tier's throughput stats"""
+        with self.generate_lock:
+            start = time.perf_counter()
+            names = self._generate_bisect(imgs, prompts, image_hashes)
+        self.throughput.record(len(imgs), time.perf_counter() - start)
+        return names
+
+    def visual_tokens(self, img: Image.Image) -> int:
+        """Relative model cost of a preprocessed image (pixel count unless overridden)"""
+        return img.width * img.height
+
+    def plan_batches(self, imgs: List[Image.Image], prompts: List[str], batch_size: int) -> List[List[int]]:
+        """Group image indices into batches of similar visual-token count and prompt length.
+
+        Sorting by cost keeps one panorama from padding every other image in its batch;
+        when ``batch_token_budget`` is set, a batch is also closed once its padded visual
+        tokens would exceed the budget. Callers restore submission order from the indices.
+        """
+        costs = [self.visual_tokens(img) for img in imgs]
+        order = sorted(range(len(imgs)), key=lambda i: (costs[i], len(prompts[i] or "")))
+        budget = settings.batch_token_budget
+
+        batches, current = [], []
+        for i in order:
+            # Sorted ascending, so costs[i] is the padded per-image cost of the grown batch
+            if current and (len(current) >= batch_size or (budget and costs[i] * (len(current) + 1) > budget)):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    @torch.inference_mode()
+    def predict_names_optimized(self, images: List[bytes], user_prompt: str) -> List[str]:
+        """GPU memory optimized batch processing with parallel preprocessing"""
+        if not images:
+            return []
+
+        print(f"🔄 Processing {len(images)} images with optimized pipeline ({self.tier} tier)...")
+
+        # Serve repeated images from the result cache and only infer the misses
+        image_hashes = [content_hash(b) for b in images]
+        cached = [self.cached_result(h, user_prompt) for h in image_hashes]
+        miss_positions = [pos for pos, name in enumerate(cached) if name is None]
+        if len(miss_positions) < len(images):
+            print(f"♻️ Result cache hits: {len(images) - len(miss_positions)}/{len(images)}")
+        if not miss_positions:
+            return cached
+        images = [images[pos] for pos in miss_positions]
+        image_hashes = [image_hashes[pos] for pos in miss_positions]
+
+        # Parallel image preprocessing (FIXED: removed incorrect 'with' statement)
+        try:
+            imgs = list(self.thread_pool.map(self.preprocess_img, images, image_hashes))
+            print(f"✅ Preprocessed {len(imgs)} images in parallel")
+        except Exception as e:
+            print(f"❌ Error in parallel preprocessing: {e}")
+            # Fallback to sequential processing
+            imgs = [self.preprocess_img(img_bytes, h) for img_bytes, h in zip(images, image_hashes)]
+
+        # Dynamic batch sizing based on GPU memory
+        dynamic_batch_size = self._get_dynamic_batch_size(len(imgs))
+        print(f"📊 Using dynamic batch size: {dynamic_batch_size}")
+
+        # Group images of similar visual-token count so padding per batch stays small
+        prompts_all = [user_prompt] * len(imgs)
+        batches = self.plan_batches(imgs, prompts_all, dynamic_batch_size)
+        all_results = [None] * len(imgs)
+
+        for batch_num, batch_indices in enumerate(batches, 1):
+            batch_imgs = [imgs[j] for j in batch_indices]
+            prompts = [prompts_all[j] for j in batch_indices]
+
+            print(f"🔄 Processing batch {batch_num}/{len(batches)}")
+
+            # Process batch with proper memory management
+            try:
+                batch_hashes = [image_hashes[j] for j in batch_indices]
+                batch_results = self._generate_timed(batch_imgs, prompts, batch_hashes)
+                self._store_results(batch_hashes, prompts, batch_results)
+                for j, name in zip(batch_indices, batch_results):
+                    all_results[j] = name
+
+                print(f"✅ Batch {batch_num} completed")
+
+            except Exception as e:
+                print(f"❌ Error processing batch {batch_num}: {e}")
+                # Add error placeholders for failed batch
+                for j in batch_indices:
+                    all_results[j] = f"error-image-{j}"
+
+            finally:
+                # Clear GPU memory after each batch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+
+        print(f"🎉 Completed processing {len(all_results)} images")
+        for pos, name in zip(miss_positions, all_results):
+            cached[pos] = name
+        return cached
+
+    @torch.inference_mode()
+    def predict_batch(self, images: List[Image.Image], prompts: List[str],
+                      image_hashes: Optional[List[str]] = None) -> List[str]:
+        """Run one GPU batch over already preprocessed images (one prompt per image).
+
+        When ``image_hashes`` (content hashes of the original bytes) are given, cached
+        names are reused and fresh results are stored in the result cache.
+        """
+        if not images:
+            return []
+        if image_hashes is None:
+            image_hashes = [None] * len(images)
+
+        results = [self.cached_result(h, p) if h else None for h, p in zip(image_hashes, prompts)]
+        miss_positions = [pos for pos, name in enumerate(results) if name is None]
+        if not miss_positions:
+            return results
+        try:
+            names = self._generate_timed(
+                [images[pos] for pos in miss_positions],
+                [prompts[pos] for pos in miss_positions],
+                [image_hashes[pos] for pos in miss_positions]
+            )
+            self._store_results([image_hashes[pos] for pos in miss_positions], [prompts[pos] for pos in miss_positions], names)
+            for pos, name in zip(miss_positions, names):
+                results[pos] = name
+            return results
+        finally:
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def predict_single(self, image_bytes: bytes, user_prompt: str) -> str:
+        """Single image through the cache and a one-image batch"""
+        image_hash = content_hash(image_bytes)
+        cached = self.cached_result(image_hash, user_prompt)
+        if cached is not None:
+            return cached
+        img = self.preprocess_img(image_bytes, image_hash)
+        return self.predict_batch([img], [user_prompt], [image_hash])[0]
+
+    # Backward compatibility
+    def predict_names(self, images: List[bytes], user_prompt: str) -> List[str]:
+        return self.predict_names_optimized(images, user_prompt)
+
+    def __del__(self):
+        """Cleanup resources"""
+        try:
+            if hasattr(self, 'thread_pool'):
+                self.thread_pool.shutdown(wait=False)
+            if getattr(self, 'process_decoder', None) is not None:
+                self.process_decoder.shutdown()
+        except:
+            pass
@@ -0,0 +1,197 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from settings import settings
+
+
+class CacheStats:
+    """Thread-safe hit/miss/eviction counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def record(self, field: str, n: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sets": self.sets,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0
+            }
+
+
+class MemoryLRUBackend:
+    """In-process LRU bounded by entry count and/or total bytes, with optional per-entry TTL"""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.current_bytes = 0
+        self.stats = CacheStats()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.stats.record("hits")
+                    return value
+                self._remove(key)
+                self.stats.record("evictions")
+        self.stats.record("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Never let one oversized entry flush the whole cache
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self.current_bytes += size
+            evicted = 0
+            while self._over_budget():
+                self._remove(next(iter(self._data)))
+                evicted += 1
+        self.stats.record("sets")
+        if evicted:
+            self.stats.record("evictions", evicted)
+
+    def _over_budget(self) -> bool:
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.current_bytes > self.max_bytes
+
+    def _remove(self, key: str):
+        _, _, size = self._data.pop(key)
+        self.current_bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """Redis-backed cache shared across processes; eviction via TTL and Redis maxmemory policy"""
+
+    def __init__(self, url: str, ttl_seconds: Optional[int] = None, prefix: str = "renamer:"):
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            print(f"⚠️ Redis cache get failed: {e}")
+            value = None
+        self.stats.record("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: str):
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl_seconds or None)
+            self.stats.record("sets")
+        except Exception as e:
+            print(f"⚠️ Redis cache set failed: {e}")
+
+
+def connect_redis(purpose: str):
+    """Client for settings.redis_url, or None (with a warning) when Redis is unreachable"""
+    try:
+        import redis
+        client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+        client.ping()
+        return client
+    except Exception as e:
+        print(f"⚠️ Redis unavailable for {purpose} ({e})")
+        return None
+
+
+_async_redis = None
+
+
+def async_redis():
+    """Shared redis.asyncio client (one connection pool per process) for settings.redis_url"""
+    global _async_redis
+    if _async_redis is None:
+        import redis.asyncio
+        _async_redis = redis.asyncio.Redis.from_url(settings.redis_url, decode_responses=True,
+                                                    socket_connect_timeout=2, socket_timeout=5)
+    return _async_redis
+
+
+def content_hash(b: bytes) -> str:
+    """Full-strength digest of raw image bytes"""
+    return hashlib.sha256(b).hexdigest()
+
+
+def normalize_prompt(user_prompt: str) -> str:
+    """Collapse case and whitespace so trivially different prompts share entries"""
+    return " ".join((user_prompt or "").lower().split())
+
+
+class ResultCache:
+    """Suggested-name cache keyed by image content, prompt and model configuration"""
+
+    def __init__(self, backend, model_id: Optional[str] = None, quantization: Optional[str] = None):
+        self.backend = backend
+        self.model_id = model_id or settings.model_id
+        self.quantization = quantization if model_id else settings.quantization
+
+    def make_key(self, image_hash: str, user_prompt: str) -> str:
+        parts = [
+            image_hash,
+            normalize_prompt(user_prompt),
+            self.model_id,
+            str(self.quantization),
+            str(settings.max_pixels),
+            str(settings.constrained_decoding)
+        ]
+        return "result:" + hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, image_hash: str, user_prompt: str) -> Optional[str]:
+        return self.backend.get(self.make_key(image_hash, user_prompt))
+
+    def set(self, image_hash: str, user_prompt: str, name: str):
+        self.backend.set(self.make_key(image_hash, user_prompt), name)
+
+    def stats(self) -> dict:
+        return {"backend": type(self.backend).__name__, **self.backend.stats.as_dict()}
+
+
+def create_result_cache(model_id: Optional[str] = None, quantization: Optional[str] = None) -> Optional[ResultCache]:
+    """Build the result cache configured by settings.result_cache_backend for one model"""
+    backend = (settings.result_cache_backend or "none").lower()
+    ttl = settings.result_cache_ttl_seconds
+    if backend == "memory":
+        return ResultCache(MemoryLRUBackend(settings.result_cache_max_entries, ttl), model_id, quantization)
+    if backend == "redis":
+        try:
+            return ResultCache(RedisBackend(settings.redis_url, ttl), model_id, quantization)
+        except Exception as e:
+            print(f"⚠️ Redis result cache unavailable ({e}), falling back to in-memory LRU")
+            return ResultCache(MemoryLRUBackend(settings.result_cache_max_entries, ttl), model_id, quantization)
+    return None
@@ -0,0 +1,64 @@
+from typing import List, Optional
+import torch
+from PIL import Image
+from transformers import AutoModelForVision2Seq, AutoProcessor
+from settings import settings
+from naming import to_kebab
+from backends import StartupTimer, VisionBackend
+from cpu_inference import prepare_cpu_model
+
+
+class CaptionBackend(VisionBackend):
+    """Fast tier: a small image captioner (BLIP by default) whose caption becomes the name.
+
+    Much cheaper per image than the chat VLM, at the cost of ignoring the user prompt:
+    captioners take no instructions, so every prompt gets the same caption-based name.
+    """
+
+    tier = "fast"
+
+    def __init__(self):
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"🚀 Initializing fast captioner {settings.fast_model_id} on device: {self.device}")
+
+        self.startup = StartupTimer()
+        with self.startup.phase("processor"):
+            self.processor = AutoProcessor.from_pretrained(settings.fast_model_id)
+        with self.startup.phase("weight_load"):
+            self.model = AutoModelForVision2Seq.from_pretrained(
+                settings.fast_model_id,
+                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                low_cpu_mem_usage=True
+            ).to(self.device).eval()
+
+        quantization = None
+        if self.device == "cpu":
+            with self.startup.phase("quantize"):
+                self.model, quantization = prepare_cpu_model(self.model)
+
+        with self.startup.phase("setup"):
+            super().__init__(settings.fast_model_id, quantization)
+
+        if settings.startup_warmup:
+            with self.startup.phase("warmup"):
+                self.warmup()
+
+        print(f"✅ Fast captioner initialized on {self.device}")
+        print(f"⏱️ Startup phases: {self.startup.summary()}")
+
+    def visual_tokens(self, img: Image.Image) -> int:
+        # Every image is resized to the same fixed resolution, so all cost the same
+        return 1
+
+    def _generate_batch(self, batch_imgs: List[Image.Image], prompts: List[str],
+                        image_hashes: Optional[List[str]] = None) -> List[str]:
+        """Caption a batch of preprocessed images"""
+        inputs = self.processor(images=batch_imgs, return_tensors="pt").to(self.device, self.model.dtype)
+        generate_ids = self.model.generate(
+            **inputs,
+            max_new_tokens=settings.fast_max_new_tokens,
+            do_sample=False,
+            num_beams=1
+        )
+        captions = self.processor.batch_decode(generate_ids, skip_special_tokens=True)
+        return [to_kebab(c) for c in captions]
@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Optional
+from settings import settings
+from cache import connect_redis
+
+
+class JobCheckpoint:
+    """Per-item progress of a job, kept in Redis so a redelivered message resumes.
+
+    Finished items (successes, and errors that used up ``item_max_attempts``) are stored
+    under their job-wide index as just their suggested name ("" for errors), since the
+    results themselves are in the manifest parts; failed attempts are counted per item,
+    across deliveries. Without Redis nothing persists: attempts are counted in memory for
+    this delivery only.
+    """
+
+    def __init__(self):
+        self.client = connect_redis("job checkpoints") if settings.job_checkpoint_enabled else None
+        self._attempts: Dict[str, int] = {}
+
+    def load(self, job_id: str, start: int, end: int) -> Dict[int, Optional[str]]:
+        """Items in [start, end) finished by earlier deliveries: index -> suggested name (None for errors)"""
+        if self.client is None or end <= start:
+            return {}
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for chunk in range(start, end, 1000):
+                pipe.hmget(f"job_done:{job_id}", [str(index) for index in range(chunk, min(chunk + 1000, end))])
+            stored = [value for values in pipe.execute() for value in values]
+        except Exception as e:
+            print(f"⚠️ Checkpoint load failed for job {job_id}: {e}")
+            return {}
+        return {start + i: value or None for i, value in enumerate(stored) if value is not None}
+
+    def save(self, job_id: str, results: List[Dict[str, Any]]):
+        """Mark items finished"""
+        if self.client is None or not results:
+            return
+        try:
+            key = f"job_done:{job_id}"
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping={str(result["index"]): result.get("suggested") or "" for result in results})
+            pipe.expire(key, settings.job_state_ttl_seconds)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Checkpoint save failed for job {job_id}: {e}")
+
+    def record_failure(self, job_id: str, index: int) -> int:
+        """Count a failed attempt at an item; returns its attempts so far"""
+        if self.client is not None:
+            try:
+                key = f"job_attempts:{job_id}"
+                pipe = self.client.pipeline()
+                pipe.hincrby(key, str(index), 1)
+                pipe.expire(key, settings.job_state_ttl_seconds)
+                return pipe.execute()[0]
+            except Exception as e:
+                print(f"⚠️ Checkpoint attempt count failed for job {job_id}: {e}")
+        key = f"{job_id}:{index}"
+        self._attempts[key] = self._attempts.get(key, 0) + 1
+        return self._attempts[key]
+
+    def clear(self, job_id: str):
+        """Drop a job's checkpoints once its manifest is written"""
+        for key in list(self._attempts):
+            if key.startswith(f"{job_id}:"):
+                del self._attempts[key]
+        if self.client is None:
+            return
+        try:
+            self.client.delete(f"job_done:{job_id}", f"job_attempts:{job_id}")
+        except Exception as e:
+            print(f"⚠️ Checkpoint cleanup failed for job {job_id}: {e}")
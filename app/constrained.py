@@ -0,0 +1,132 @@
+import re
+from typing import Dict, List, Optional
+import torch
+from transformers import LogitsProcessor
+from naming import BLOCK
+
+_token_re = re.compile(r"[a-z0-9-]+")
+
+
+class KebabVocabulary:
+    """Per-tokenizer tables of the tokens that can appear in a kebab-case filename.
+
+    Built once per model load: decoding the whole vocabulary is the expensive part.
+    """
+
+    def __init__(self, tokenizer, eos_token_ids: List[int]):
+        vocab_size = len(tokenizer)
+        texts = tokenizer.batch_decode([[i] for i in range(vocab_size)])
+
+        self.eos_token_ids = [i for i in eos_token_ids if i is not None]
+        self.token_text: Dict[int, str] = {}
+        allowed = torch.zeros(vocab_size, dtype=torch.bool)
+        starts_hyphen = torch.zeros(vocab_size, dtype=torch.bool)
+        ends_hyphen = torch.zeros(vocab_size, dtype=torch.bool)
+        # Non-empty hyphen-separated segments, e.g. 2 for "sun-set" and "-sun-set-"
+        word_counts = torch.zeros(vocab_size, dtype=torch.long)
+        lengths = torch.zeros(vocab_size, dtype=torch.long)
+        # Hyphenated tokens grouped by the word fragment before their first hyphen
+        self.hyphen_tokens_by_head: Dict[str, List[int]] = {}
+
+        for i, text in enumerate(texts):
+            if not _token_re.fullmatch(text or ""):
+                continue
+            segments = text.split("-")
+            # Tokens that contain a whole blocked word between hyphens can never be valid
+            if any(seg in BLOCK for seg in segments[1:-1]):
+                continue
+            allowed[i] = True
+            lengths[i] = len(text)
+            self.token_text[i] = text
+            word_counts[i] = sum(1 for seg in segments if seg)
+            if "-" in text:
+                starts_hyphen[i] = text.startswith("-")
+                ends_hyphen[i] = text.endswith("-")
+                self.hyphen_tokens_by_head.setdefault(segments[0], []).append(i)
+
+        self.allowed = allowed
+        self.starts_hyphen = starts_hyphen
+        self.ends_hyphen = ends_hyphen
+        self.word_counts = word_counts
+        self.lengths = lengths
+
+
+class KebabLogitsProcessor(LogitsProcessor):
+    """Restricts generation to ``[a-z0-9-]`` filenames and ends them as soon as they are complete.
+
+    Enforces the same limits as ``naming.to_kebab`` during decoding: no leading or
+    doubled hyphens, at most ``max_words`` words and ``max_len`` characters, and no
+    word from ``BLOCK``. Once a limit is reached only EOS is allowed, so generation
+    stops instead of producing text that would be thrown away.
+    """
+
+    def __init__(self, vocab: KebabVocabulary, prompt_length: int, max_words: int = 10, max_len: int = 60):
+        self.vocab = vocab
+        self.prompt_length = prompt_length
+        self.max_words = max_words
+        self.max_len = max_len
+        self._device_tables: Optional[tuple] = None
+
+    def _tables(self, device, size: int):
+        if self._device_tables is None or self._device_tables[0].device != device:
+            def fit(t):
+                # The model's logits may be wider than the tokenizer vocabulary
+                out = torch.zeros(size, dtype=t.dtype)
+                n = min(size, t.shape[0])
+                out[:n] = t[:n]
+                return out.to(device)
+            self._device_tables = (
+                fit(self.vocab.allowed), fit(self.vocab.starts_hyphen), fit(self.vocab.ends_hyphen),
+                fit(self.vocab.word_counts), fit(self.vocab.lengths)
+            )
+        return self._device_tables
+
+    def _text(self, ids: List[int]) -> str:
+        return "".join(self.vocab.token_text.get(i, "") for i in ids)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        allowed, starts_hyphen, ends_hyphen, word_counts, lengths = self._tables(scores.device, scores.shape[-1])
+        eos_ids = [i for i in self.vocab.eos_token_ids if i < scores.shape[-1]]
+
+        for row in range(scores.shape[0]):
+            text = self._text(input_ids[row, self.prompt_length:].tolist())
+            words = [w for w in text.split("-") if w]
+            current = "" if text.endswith("-") else (words[-1] if words else "")
+
+            mask = allowed.clone()
+            # Tokens must fit within the character limit
+            mask &= lengths <= (self.max_len - len(text))
+            if not text or text.endswith("-"):
+                # No leading or doubled hyphens
+                mask &= ~starts_hyphen
+            # Words each token would add: its first segment continues the current word
+            added = word_counts
+            if text and not text.endswith("-"):
+                added = word_counts - (~starts_hyphen).long()
+            total = len(words) + added
+            mask &= total <= self.max_words
+            # At the limit, a trailing hyphen could only lead to a word past it
+            mask &= ~(ends_hyphen & (total >= self.max_words))
+            # Tokens whose first fragment would complete a blocked word
+            for word in BLOCK:
+                if word.startswith(current):
+                    for i in self.vocab.hyphen_tokens_by_head.get(word[len(current):], []):
+                        if i < mask.shape[0]:
+                            mask[i] = False
+
+            end_allowed = bool(text) and not text.endswith("-") and current not in BLOCK
+            if current in BLOCK:
+                # A blocked word may only continue into a longer word
+                mask &= ~starts_hyphen
+
+            if not mask.any() or len(text) >= self.max_len:
+                # Filename is complete: force EOS
+                mask[:] = False
+                end_allowed = True
+            for i in eos_ids:
+                mask[i] = end_allowed
+            if not mask.any():
+                mask[eos_ids] = True
+
+            scores[row] = scores[row].masked_fill(~mask, float("-inf"))
+        return scores
@@ -0,0 +1,48 @@
+import os
+import torch
+from settings import settings
+
+# Configured once per process: torch only accepts the inter-op thread count before any parallel work
+_threads_configured = False
+
+
+def configure_cpu_threads() -> int:
+    """Pin torch's intra-op pool to the cores this process may use (settings.cpu_threads overrides)"""
+    global _threads_configured
+    threads = settings.cpu_threads or len(os.sched_getaffinity(0))
+    if not _threads_configured:
+        torch.set_num_threads(threads)
+        try:
+            # One generate call at a time: parallelism comes from inside each matmul
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        _threads_configured = True
+    return torch.get_num_threads()
+
+
+def quantize_dynamic_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized per batch).
+
+    Linear layers dominate decoder and vision-tower time on CPU; int8 weights also cut
+    their memory traffic by 4x versus float32. Embeddings and norms stay float32.
+    """
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    visual = getattr(model, "visual", None)
+    if visual is not None and hasattr(visual, "get_dtype"):
+        # Qwen2-VL reads the vision dtype from a Linear weight, which is a method once quantized
+        visual.get_dtype = lambda: torch.float32
+    return model
+
+
+def prepare_cpu_model(model: torch.nn.Module) -> tuple:
+    """Apply the CPU mode selected by settings.quantization; returns (model, effective quantization)"""
+    threads = configure_cpu_threads()
+    quantization = None
+    if settings.quantization == "int8":
+        model = quantize_dynamic_int8(model)
+        quantization = "int8"
+    elif settings.quantization in ("8bit", "4bit"):
+        print(f"⚠️ {settings.quantization} quantization needs CUDA (bitsandbytes); use QUANTIZATION=int8 on CPU")
+    print(f"🧮 CPU inference: {threads} threads, {quantization or 'float32'} weights")
+    return model.eval(), quantization
@@ -0,0 +1,177 @@
+import io
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+from PIL import Image
+
+# Import for HEIC support
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_AVAILABLE = True
+except ImportError:
+    HEIF_AVAILABLE = False
+
+# Import for SVG support
+try:
+    import cairosvg
+    SVG_AVAILABLE = True
+except ImportError:
+    SVG_AVAILABLE = False
+
+# ISO-BMFF brands used by HEIC/HEIF/AVIF containers
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1", b"avif", b"avis"}
+
+# JPEG draft decoding keeps this much headroom over the target before the final LANCZOS pass
+_DRAFT_GAP = 2.0
+
+
+def sniff_format(b: bytes) -> Optional[str]:
+    """Identify the image container from its magic bytes"""
+    if b[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if b[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if b[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if b[:4] == b"RIFF" and b[8:12] == b"WEBP":
+        return "webp"
+    if b[4:8] == b"ftyp" and b[8:12] in _HEIF_BRANDS:
+        return "avif" if b[8:12] in (b"avif", b"avis") else "heic"
+    if b[:2] == b"BM":
+        return "bmp"
+    if b[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    head = b[:256].lstrip()
+    if head[:5] == b"<?xml" or b"<svg" in head:
+        return "svg"
+    return None
+
+
+def target_size(width: int, height: int, max_pixels: int) -> Tuple[int, int]:
+    """Final size for an image whose long side is capped at sqrt(max_pixels)"""
+    long = max(width, height)
+    target_long = int(max_pixels ** 0.5)
+    if long <= target_long:
+        return width, height
+    scale = target_long / long
+    return int(width * scale), int(height * scale)
+
+
+class DecodeStats:
+    """Per-format decode counts and timings"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, fmt: str, seconds: float):
+        with self._lock:
+            entry = self._stats.setdefault(fmt, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = seconds * 1000
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                fmt: {**entry, "avg_ms": entry["total_ms"] / entry["count"]}
+                for fmt, entry in self._stats.items()
+            }
+
+
+decode_stats = DecodeStats()
+
+
+def _open(b: bytes, fmt: Optional[str], max_pixels: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Open lazily and, where the codec supports it, request a reduced-resolution decode.
+
+    Returns the image and the final size computed from its full-resolution dimensions.
+    """
+    if fmt == "svg":
+        if not SVG_AVAILABLE:
+            raise ValueError("SVG support is not installed")
+        b = cairosvg.svg2png(bytestring=b)
+        fmt = "png"
+    if fmt in ("heic", "avif") and not HEIF_AVAILABLE:
+        raise ValueError("HEIC/AVIF support is not installed")
+
+    # HEIC is decoded from memory by the registered pillow-heif opener (no temp files)
+    im = Image.open(io.BytesIO(b))
+    size = target_size(im.width, im.height, max_pixels)
+
+    if fmt == "jpeg" and size != im.size:
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, staying above the target size
+        im.draft("RGB", (math.ceil(size[0] * _DRAFT_GAP), math.ceil(size[1] * _DRAFT_GAP)))
+    return im, size
+
+
+def decode_image(b: bytes, max_pixels: int) -> Image.Image:
+    """Decode image bytes to an RGB image whose long side fits sqrt(max_pixels).
+
+    The format is sniffed up front; JPEGs use draft (DCT-scaled) decoding so large photos
+    are decoded close to the target size, and other formats are box-reduced before the
+    final high-quality resample.
+    """
+    fmt = sniff_format(b)
+    start = time.perf_counter()
+    try:
+        im, size = _open(b, fmt, max_pixels)
+        im = im.convert("RGB")
+    except Exception as e:
+        raise ValueError(f"Unsupported image format ({fmt or 'unknown'}): {e}")
+
+    if size != im.size:
+        # Use high-quality resampling for better AI recognition
+        im = im.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    decode_stats.record(fmt or "unknown", time.perf_counter() - start)
+    return im
+
+
+def _decode_to_shared_memory(b: bytes, max_pixels: int) -> Tuple[str, Tuple[int, int], str, float]:
+    """Process-pool task: decode, then hand the RGB pixels back through shared memory"""
+    fmt = sniff_format(b) or "unknown"
+    start = time.perf_counter()
+    im = decode_image(b, max_pixels)
+    data = im.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    # The parent owns the segment from here on and unlinks it after attaching
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return shm.name, im.size, fmt, time.perf_counter() - start
+
+
+class ProcessDecoder:
+    """Decodes images in worker processes, sidestepping the GIL for HEIF/SVG/PIL work.
+
+    Workers return only a shared-memory segment name and the image size; the parent
+    copies the RGB pixels out once and unlinks the segment, so full images are never
+    pickled across the process boundary.
+    """
+
+    def __init__(self, max_workers: int):
+        # Spawn rather than fork: the parent may already hold CUDA state. Spawned children
+        # re-import the parent's __main__, so entry scripts keep model and client setup out
+        # of module level (see worker.py)
+        self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def decode(self, b: bytes, max_pixels: int) -> Image.Image:
+        name, size, fmt, seconds = self.pool.submit(_decode_to_shared_memory, b, max_pixels).result()
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            im = Image.frombytes("RGB", size, shm.buf[:size[0] * size[1] * 3])
+        finally:
+            shm.close()
+            shm.unlink()
+        decode_stats.record(fmt, seconds)
+        return im
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -1,72 +1,104 @@
-from typing import List, Tuple
-import io
-import tempfile
-import os
-import asyncio
+import time
+_import_start = time.perf_counter()
+from typing import List, Optional, Tuple
 import threading
-import hashlib
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
+from contextlib import nullcontext
 from PIL import Image
 import torch
-from transformers import AutoModelForVision2Seq, AutoProcessor, BitsAndBytesConfig
+from transformers import AutoModelForVision2Seq, AutoProcessor, BitsAndBytesConfig, LogitsProcessorList
+try:
+    from transformers.models.qwen2_vl.image_processing_qwen2_vl import smart_resize
+except ImportError:
+    smart_resize = None
 from settings import settings
 from naming import to_kebab, system_prompt
+from cache import MemoryLRUBackend
+from backends import StartupTimer, VisionBackend
+from captioner import CaptionBackend
+from cpu_inference import prepare_cpu_model
+from vision_cache import CachedVisionTower
+from constrained import KebabLogitsProcessor, KebabVocabulary
+from prefix_cache import SystemPrefixCache
+from speculative import RecentOutputLookup
+from materialize import usable_artifact
 
-# Import for HEIC support
-try:
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-    HEIF_AVAILABLE = True
-except ImportError:
-    HEIF_AVAILABLE = False
+# Seconds spent importing torch, transformers and the app modules
+IMPORT_SECONDS = time.perf_counter() - _import_start
 
-# Import for SVG support
-try:
-    import cairosvg
-    SVG_AVAILABLE = True
-except ImportError:
-    SVG_AVAILABLE = False
 
+def quantization_config_for(device: str) -> Optional[BitsAndBytesConfig]:
+    """BitsAndBytes config for settings.quantization (CUDA only)"""
+    # Optimized 8-bit quantization for speed + cost balance
+    if settings.quantization and device == "cuda":
+        if settings.quantization == "8bit":
+            return BitsAndBytesConfig(
+                load_in_8bit=True,
+                bnb_8bit_compute_dtype=torch.float16,
+                bnb_8bit_use_double_quant=False
+            )
+        elif settings.quantization == "4bit":
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16
+            )
+    return None
+
+
+def load_model(source: str, device: str, from_artifact: bool = False) -> Tuple[torch.nn.Module, Optional[str]]:
+    """Load the quality-tier weights; returns the model and the quantization baked into them.
+
+    A materialized artifact already carries its BitsAndBytes config and quantized weights,
+    which ``from_pretrained`` memory-maps from safetensors instead of re-quantizing.
+    """
+    quantization_config = quantization_config_for(device)
+    quantized = quantization_config is not None
+    model = AutoModelForVision2Seq.from_pretrained(
+        source,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        low_cpu_mem_usage=True,
+        quantization_config=None if from_artifact else quantization_config,
+        device_map="auto" if quantized else None,
+        # Additional memory optimizations
+        max_memory={0: "13GB", "cpu": "30GB"} if device == "cuda" else {"cpu": "15GB"},
+        offload_folder="./model_offload" if device == "cuda" else None
+    )
+    
+    # Only move to device if not using quantization (device_map handles it)
+    if not quantized:
+        model = model.to(device)
+    return model, settings.quantization if quantized else None
+
+
+class OptimizedVLM(VisionBackend):
+    """Quality tier: Qwen2-VL chat model prompted for a filename"""
+
+    tier = "quality"
 
-class OptimizedVLM:
     def __init__(self):
+        self.startup = StartupTimer({"import": IMPORT_SECONDS})
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"🚀 Initializing VLM on device: {self.device}")
         
-        self.processor = AutoProcessor.from_pretrained(settings.model_id)
+        # Pre-quantized local artifact from materialize.py, if one matches this config
+        artifact_dir = usable_artifact(self.device)
+        source = artifact_dir or settings.model_id
+        if artifact_dir:
+            print(f"📦 Loading materialized checkpoint from {artifact_dir}")
         
-        # Optimized 8-bit quantization for speed + cost balance
-        quantization_config = None
-        if settings.quantization and self.device == "cuda":
-            if settings.quantization == "8bit":
-                quantization_config = BitsAndBytesConfig(
-                    load_in_8bit=True,
-                    bnb_8bit_compute_dtype=torch.float16,
-                    bnb_8bit_use_double_quant=False
-                )
-            elif settings.quantization == "4bit":
-                quantization_config = BitsAndBytesConfig(
-                    load_in_4bit=True,
-                    bnb_4bit_use_double_quant=True,
-                    bnb_4bit_quant_type="nf4",
-                    bnb_4bit_compute_dtype=torch.float16
-                )
+        with self.startup.phase("processor"):
+            self.processor = AutoProcessor.from_pretrained(source)
         
-        self.model = AutoModelForVision2Seq.from_pretrained(
-            settings.model_id,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            low_cpu_mem_usage=True,
-            quantization_config=quantization_config,
-            device_map="auto" if quantization_config else None,
-            # Additional memory optimizations
-            max_memory={0: "13GB", "cpu": "30GB"} if self.device == "cuda" else {"cpu": "15GB"},
-            offload_folder="./model_offload" if self.device == "cuda" else None
-        )
+        with self.startup.phase("weight_load"):
+            # BitsAndBytes quantizes during this load unless the artifact already holds quantized weights
+            self.model, quantization = load_model(source, self.device, from_artifact=bool(artifact_dir))
         
-        # Only move to device if not using quantization (device_map handles it)
-        if not quantization_config:
-            self.model = self.model.to(self.device)
+        # CPU workers: tuned threading and optional dynamic int8 weights (QUANTIZATION=int8)
+        if self.device == "cpu":
+            with self.startup.phase("quantize"):
+                self.model, quantization = prepare_cpu_model(self.model)
+        setup_start = time.perf_counter()
         
         # Get actual model device for proper tensor placement
         if hasattr(self.model, 'device'):
@@ -74,327 +106,201 @@ class OptimizedVLM:
         else:
             self.model_device = next(self.model.parameters()).device
         
-        # Fixed thread pool for parallel image preprocessing
-        self.thread_pool = ThreadPoolExecutor(max_workers=settings.parallel_downloads)
+        # Token tables for constrained kebab-case decoding (built once per model load)
+        self.kebab_vocab = None
+        if settings.constrained_decoding:
+            tokenizer = self.processor.tokenizer
+            eos_token_ids = {tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<|im_end|>")}
+            generation_eos = getattr(self.model.generation_config, "eos_token_id", None)
+            if isinstance(generation_eos, list):
+                eos_token_ids.update(generation_eos)
+            elif generation_eos is not None:
+                eos_token_ids.add(generation_eos)
+            self.kebab_vocab = KebabVocabulary(tokenizer, [i for i in eos_token_ids if isinstance(i, int) and i >= 0])
         
-        # Image cache for repeated processing (LRU cache with size limit)
-        self._preprocess_cache = {}
-        self._cache_max_size = 100  # Limit cache size to prevent memory bloat
-        self._cache_lock = threading.Lock()
+        # Memoized chat-template text per user prompt
+        self._template_cache = MemoryLRUBackend(max_entries=1024)
         
-        print(f"✅ VLM initialized on {self.model_device}")
-
-    def _get_image_hash(self, b: bytes) -> str:
-        """Generate hash for image caching"""
-        return hashlib.md5(b).hexdigest()[:16]
-
-    def _get_cached_image(self, img_hash: str) -> Image.Image:
-        """Thread-safe cache retrieval"""
-        with self._cache_lock:
-            return self._preprocess_cache.get(img_hash)
+        # System-prompt prefix KV cache, prefilled once per model load on first use
+        self.prefix_cache = None
+        if settings.prefix_cache_enabled:
+            prefix_text = self._chat_text("").split("<|vision_start|>")[0]
+            self.prefix_cache = SystemPrefixCache(self.model, self.processor.tokenizer, prefix_text, self.model_device)
+        
+        # Opt-in speculative decoding: drafts from recent filenames, verified by the model
+        self.speculative = None
+        if settings.speculative_decoding:
+            self.speculative = RecentOutputLookup(
+                settings.speculative_history, settings.speculative_num_tokens, settings.speculative_max_ngram
+            )
+            default_candidate_generator = self.model._get_candidate_generator
 
-    def _cache_image(self, img_hash: str, image: Image.Image):
-        """Thread-safe cache storage with size limit"""
-        with self._cache_lock:
-            # Implement simple LRU by removing oldest entries
-            if len(self._preprocess_cache) >= self._cache_max_size:
-                # Remove oldest 20% of entries
-                items_to_remove = len(self._preprocess_cache) // 5
-                for _ in range(items_to_remove):
-                    self._preprocess_cache.pop(next(iter(self._preprocess_cache)))
-            
-            self._preprocess_cache[img_hash] = image
+            def candidate_generator(generation_config, *args, **kwargs):
+                if generation_config.prompt_lookup_num_tokens is not None:
+                    return self.speculative.candidate_generator(generation_config)
+                return default_candidate_generator(generation_config, *args, **kwargs)
 
-    def preprocess_img(self, b: bytes) -> Image.Image:
-        """Memory-optimized image preprocessing with caching"""
-        # Check cache first
-        img_hash = self._get_image_hash(b)
-        cached_img = self._get_cached_image(img_hash)
-        if cached_img is not None:
-            return cached_img.copy()  # Return copy to avoid modification issues
-        
-        im = None
-        temp_path = None
+            self.model._get_candidate_generator = candidate_generator
         
-        try:
-            # First try direct PIL opening (handles JPEG, PNG, etc.)
-            with io.BytesIO(b) as bio:
-                im = Image.open(bio).convert("RGB")
-        except Exception as e:
-            # If direct opening fails, try alternative formats
-            try:
-                # Try SVG conversion first (no temp file needed)
-                if SVG_AVAILABLE and (b[:5] == b'<?xml' or b'<svg' in b[:100]):
-                    png_data = cairosvg.svg2png(bytestring=b)
-                    with io.BytesIO(png_data) as bio:
-                        im = Image.open(bio).convert("RGB")
-                else:
-                    # For HEIC and other formats, use secure temp file
-                    temp_path = f"/tmp/img_{img_hash}_{os.getpid()}"
-                    try:
-                        with open(temp_path, 'wb') as f:
-                            f.write(b)
-                        im = Image.open(temp_path).convert("RGB")
-                    finally:
-                        if temp_path and os.path.exists(temp_path):
-                            os.unlink(temp_path)
-                            
-            except Exception as e2:
-                raise ValueError(f"Unsupported image format. Original error: {e}, Secondary error: {e2}")
-        
-        if im is None:
-            raise ValueError("Failed to load image")
+        # Optional vision-embedding cache so re-prompting an image skips the vision tower
+        self.vision_cache = None
+        if settings.vision_cache_enabled and hasattr(self.model, "visual"):
+            self.vision_cache = CachedVisionTower(self.model.visual, settings.vision_cache_max_bytes)
+            self.model.visual = self.vision_cache
         
-        # Optimized resize for better GPU utilization
-        long = max(im.size)
-        target_long = int((settings.max_pixels)**0.5)
-        if long > target_long:
-            scale = target_long / long
-            # Use high-quality resampling for better AI recognition
-            im = im.resize((int(im.width*scale), int(im.height*scale)), Image.Resampling.LANCZOS)
+        # Decoding, caches, batch autotuning and throughput stats shared by every tier
+        super().__init__(settings.model_id, quantization)
+        self.startup.record("setup", time.perf_counter() - setup_start)
         
-        # Cache the processed image
-        self._cache_image(img_hash, im)
+        if settings.startup_warmup:
+            with self.startup.phase("warmup"):
+                self.warmup()
         
-        return im
+        print(f"✅ VLM initialized on {self.model_device}")
+        print(f"⏱️ Startup phases: {self.startup.summary()}")
 
-    def _get_dynamic_batch_size(self, num_images: int) -> int:
-        """Calculate optimal batch size based on available GPU memory"""
-        if not torch.cuda.is_available():
-            return min(settings.max_batch_size, num_images)
-        
-        try:
-            # Get GPU memory info
-            gpu_memory = torch.cuda.get_device_properties(0).total_memory
-            allocated_memory = torch.cuda.memory_allocated()
-            available_memory = gpu_memory - allocated_memory
-            
-            # Estimate memory per image (rough heuristic)
-            memory_per_image = 50 * 1024 * 1024  # 50MB per image (conservative estimate)
-            safe_batch_size = max(1, int(available_memory * 0.7 / memory_per_image))  # Use 70% of available memory
-            
-            return min(settings.max_batch_size, safe_batch_size, num_images)
-        except:
-            # Fallback to conservative batch size
-            return min(2, settings.max_batch_size, num_images)
+    def _vision_keys(self, imgs: List[Image.Image], image_hashes: Optional[List[str]]):
+        """Context announcing vision-cache keys for the images of the next generate call"""
+        if self.vision_cache is None or not image_hashes or not any(image_hashes):
+            return nullcontext()
+        keys = [CachedVisionTower.make_key(h, img.size) if h else None for img, h in zip(imgs, image_hashes)]
+        return self.vision_cache.image_keys(keys)
 
-    @torch.inference_mode()
-    def predict_names_optimized(self, images: List[bytes], user_prompt: str) -> List[str]:
-        """GPU memory optimized batch processing with parallel preprocessing"""
-        if not images:
-            return []
-        
-        print(f"🔄 Processing {len(images)} images with optimized pipeline...")
-        
-        # Parallel image preprocessing (FIXED: removed incorrect 'with' statement)
-        try:
-            imgs = list(self.thread_pool.map(self.preprocess_img, images))
-            print(f"✅ Preprocessed {len(imgs)} images in parallel")
-        except Exception as e:
-            print(f"❌ Error in parallel preprocessing: {e}")
-            # Fallback to sequential processing
-            imgs = [self.preprocess_img(img_bytes) for img_bytes in images]
-        
-        # Dynamic batch sizing based on GPU memory
-        dynamic_batch_size = self._get_dynamic_batch_size(len(imgs))
-        print(f"📊 Using dynamic batch size: {dynamic_batch_size}")
-        
-        all_results = []
+    def visual_tokens(self, img: Image.Image) -> int:
+        """Number of visual tokens the processor will produce for a preprocessed image"""
+        image_processor = getattr(self.processor, "image_processor", None)
+        patch_size = getattr(image_processor, "patch_size", None)
+        merge_size = getattr(image_processor, "merge_size", None)
+        if smart_resize is None or not patch_size or not merge_size:
+            # Non Qwen2-VL processors: cost is proportional to pixel count
+            return img.width * img.height
+        factor = patch_size * merge_size
+        height, width = smart_resize(
+            img.height, img.width, factor=factor,
+            min_pixels=image_processor.min_pixels, max_pixels=image_processor.max_pixels
+        )
+        return (height // factor) * (width // factor)
+
+    def _generation_kwargs(self, prompt_length: int) -> dict:
+        """Greedy generate() arguments, constrained to kebab-case filenames when enabled"""
+        kwargs = {
+            "max_new_tokens": settings.max_new_tokens,
+            "do_sample": False,
+            "temperature": 0.0,
+            "pad_token_id": self.processor.tokenizer.eos_token_id
+        }
+        if self.kebab_vocab is not None:
+            # Every allowed token adds at least one character, so the filename limit bounds decode steps
+            kwargs["max_new_tokens"] = min(settings.max_new_tokens, 61)
+            kwargs["logits_processor"] = LogitsProcessorList([KebabLogitsProcessor(self.kebab_vocab, prompt_length)])
+        return kwargs
+
+    def _chat_text(self, prompt: str) -> str:
+        """Chat-template text for a user prompt, memoized (the image itself is not rendered)"""
+        text = self._template_cache.get(prompt)
+        if text is None:
+            messages = [
+                {
+                    "role": "system",
+                    "content": system_prompt()
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image"},
+                        {"type": "text", "text": prompt if prompt else "Analyze this image and generate a descriptive filename."}
+                    ]
+                }
+            ]
+            text = self.processor.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            self._template_cache.set(prompt, text)
+        return text
+
+    def _run_generate(self, inputs: dict) -> torch.Tensor:
+        """generate(), reusing the shared system-prompt KV prefix when the inputs allow it"""
+        input_ids = inputs["input_ids"]
+        kwargs = self._generation_kwargs(input_ids.shape[1])
+        if self.speculative is not None and input_ids.shape[0] == 1:
+            # transformers only supports assisted (draft-and-verify) decoding at batch size 1
+            kwargs["prompt_lookup_num_tokens"] = settings.speculative_num_tokens
         
-        for i in range(0, len(imgs), dynamic_batch_size):
-            batch_imgs = imgs[i:i + dynamic_batch_size]
-            full_prompt = system_prompt() + (f" {user_prompt}" if user_prompt else "")
-            
-            print(f"🔄 Processing batch {i//dynamic_batch_size + 1}/{(len(imgs) + dynamic_batch_size - 1)//dynamic_batch_size}")
-            
-            # Process batch with proper memory management
+        generate_ids = None
+        if self.prefix_cache is not None:
             try:
-                # Create proper chat messages for each image
-                batch_messages = []
-                for img in batch_imgs:
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": system_prompt()
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "image", "image": img},
-                                {"type": "text", "text": user_prompt if user_prompt else "Analyze this image and generate a descriptive filename."}
-                            ]
-                        }
-                    ]
-                    batch_messages.append(messages)
-                
-                # Apply chat template for each message set
-                texts = []
-                for messages in batch_messages:
-                    text = self.processor.apply_chat_template(
-                        messages, tokenize=False, add_generation_prompt=True
-                    )
-                    texts.append(text)
-                
-                inputs = self.processor(text=texts, images=batch_imgs, return_tensors="pt", padding=True)
-                
-                # Move to correct device (handle device_map scenarios)
-                inputs = {k: v.to(self.model_device) if hasattr(v, 'to') else v for k, v in inputs.items()}
-                
-                generate_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=settings.max_new_tokens,
-                    do_sample=False,
-                    temperature=0.0,
-                    pad_token_id=self.processor.tokenizer.eos_token_id
-                )
-                
-                # Only decode the new tokens (remove input tokens)
-                generated_ids_trimmed = [
-                    out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generate_ids)
-                ]
-                batch_results = self.processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True)
-                all_results.extend([to_kebab(o) for o in batch_results])
-                
-                print(f"✅ Batch {i//dynamic_batch_size + 1} completed")
-                
-            except torch.cuda.OutOfMemoryError as e:
-                print(f"⚠️ GPU OOM in batch {i//dynamic_batch_size + 1}, falling back to smaller batches")
-                # Clear cache and retry with smaller batch
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                
-                # Process images one by one as fallback
-                for j, (img, prompt) in enumerate(zip(batch_imgs, prompts)):
-                    try:
-                        single_result = self._process_single_image(img, prompt)
-                        all_results.append(single_result)
-                    except Exception as e2:
-                        print(f"❌ Failed to process image {i+j}: {e2}")
-                        all_results.append(f"error-image-{i+j}")
-                        
+                generate_ids = self.prefix_cache.generate(inputs, **kwargs)
+            except torch.cuda.OutOfMemoryError:
+                raise
             except Exception as e:
-                print(f"❌ Error processing batch {i//dynamic_batch_size + 1}: {e}")
-                # Add error placeholders for failed batch
-                all_results.extend([f"error-image-{i+j}" for j in range(len(batch_imgs))])
-                
-            finally:
-                # Clear GPU memory after each batch
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
+                print(f"⚠️ Prefix KV cache disabled after error: {e}")
+                self.prefix_cache = None
+        if generate_ids is None:
+            generate_ids = self.model.generate(**inputs, **kwargs)
         
-        print(f"🎉 Completed processing {len(all_results)} images")
-        return all_results
+        if self.speculative is not None:
+            self._observe_outputs(input_ids, generate_ids)
+        return generate_ids
 
-    def _process_single_image(self, img: Image.Image, prompt: str) -> str:
-        """Process single image (helper for OOM fallback)"""
-        # Use the actual user prompt with proper chat template
-        messages = [
-            {
-                "role": "system",
-                "content": system_prompt()
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": img},
-                    {"type": "text", "text": prompt if prompt else "Analyze this image and generate a descriptive filename."}
-                ]
-            }
-        ]
-        
-        # Apply chat template
-        text = self.processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        
-        print(f"🔍 Using user prompt: {repr(prompt)}")
-        
-        # Process with proper chat template
-        inputs = self.processor(
-            text=[text], 
-            images=[img], 
-            return_tensors="pt", 
-            padding=True
-        )
+    def _observe_outputs(self, input_ids: torch.Tensor, generate_ids: torch.Tensor):
+        """Feed finished filenames to the speculative drafter"""
+        eos_ids = {self.processor.tokenizer.eos_token_id, self.processor.tokenizer.convert_tokens_to_ids("<|im_end|>")}
+        for prompt_ids, output_ids in zip(input_ids.tolist(), generate_ids[:, input_ids.shape[1]:].tolist()):
+            # Keep the terminating EOS so drafts can end where past filenames ended
+            for i, token in enumerate(output_ids):
+                if token in eos_ids:
+                    output_ids = output_ids[:i + 1]
+                    break
+            self.speculative.observe(prompt_ids, output_ids)
+
+    def _generate_batch(self, batch_imgs: List[Image.Image], prompts: List[str],
+                        image_hashes: Optional[List[str]] = None) -> List[str]:
+        """Run a single batched generate call over preprocessed images"""
+        texts = [self._chat_text(prompt) for prompt in prompts]
         
-        print(f"🔍 INPUTS TYPE: {type(inputs)}")
-        print(f"🔍 INPUTS KEYS: {list(inputs.keys()) if hasattr(inputs, 'keys') else 'No keys'}")
+        inputs = self.processor(text=texts, images=batch_imgs, return_tensors="pt", padding=True)
         
-        # Move inputs to device properly
-        if isinstance(inputs, dict):
-            inputs = {k: v.to(self.model_device) if hasattr(v, 'to') else v for k, v in inputs.items()}
-        else:
-            inputs = inputs.to(self.model_device)
+        # Move to correct device (handle device_map scenarios)
+        inputs = {k: v.to(self.model_device) if hasattr(v, 'to') else v for k, v in inputs.items()}
         
-        generate_ids = self.model.generate(
-            **inputs,
-            max_new_tokens=settings.max_new_tokens,
-            do_sample=False,
-            temperature=0.0,
-            pad_token_id=self.processor.tokenizer.eos_token_id
-        )
+        with self._vision_keys(batch_imgs, image_hashes):
+            generate_ids = self._run_generate(inputs)
         
         # Only decode the new tokens (remove input tokens)
-        if hasattr(inputs, 'input_ids'):
-            input_ids = inputs.input_ids
-        elif isinstance(inputs, dict) and 'input_ids' in inputs:
-            input_ids = inputs['input_ids']
-        else:
-            print(f"🔍 INPUTS STRUCTURE: {inputs}")
-            raise ValueError(f"Cannot find input_ids in inputs: {type(inputs)}")
-            
         generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(input_ids, generate_ids)
+            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs["input_ids"], generate_ids)
         ]
-        out = self.processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True)[0]
-        print(f"🔍 RAW MODEL OUTPUT: {repr(out)}")
-        result = to_kebab(out)
-        print(f"🔍 AFTER TO_KEBAB: {repr(result)}")
-        return result
+        batch_results = self.processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True)
+        return [to_kebab(o) for o in batch_results]
 
-    @torch.inference_mode()
-    def predict_single(self, image_bytes: bytes, user_prompt: str) -> str:
-        """Optimized single image processing for preview endpoint"""
-        print(f"🔍 PREDICT_SINGLE called with prompt: {repr(user_prompt)}")
-        img = self.preprocess_img(image_bytes)
-        print(f"🔍 Image preprocessed, size: {img.size}")
-        try:
-            result = self._process_single_image(img, user_prompt)
-            print(f"🔍 PREDICT_SINGLE returning: {repr(result)}")
-            return result
-        except torch.cuda.OutOfMemoryError:
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            return self._process_single_image(img, user_prompt)
-        except Exception as e:
-            print(f"❌ Error in single prediction: {e}")
-            raise
+# Backend class per tier; each is loaded lazily on first use
+TIERS = {
+    "quality": OptimizedVLM,
+    "fast": CaptionBackend
+}
 
-    # Backward compatibility
-    def predict_names(self, images: List[bytes], user_prompt: str) -> List[str]:
-        return self.predict_names_optimized(images, user_prompt)
-
-    def __del__(self):
-        """Cleanup resources"""
-        try:
-            if hasattr(self, 'thread_pool'):
-                self.thread_pool.shutdown(wait=False)
-        except:
-            pass
-
-
-# Thread-safe singleton with double-check locking
+# Thread-safe per-tier singletons with double-check locking
 _vlm_lock = threading.Lock()
-vlm = None
+_backends = {}
 
 
-def get_vlm() -> OptimizedVLM:
-    """Thread-safe singleton VLM instance"""
-    global vlm
-    if vlm is None:
+def get_vlm(tier: Optional[str] = None) -> VisionBackend:
+    """Thread-safe singleton backend for a tier (settings.default_tier when omitted)"""
+    tier = tier or settings.default_tier
+    if tier not in TIERS:
+        raise ValueError(f"Unknown model tier '{tier}' (expected one of: {', '.join(TIERS)})")
+    backend = _backends.get(tier)
+    if backend is None:
         with _vlm_lock:
-            if vlm is None:  # Double-check locking pattern
-                print("🤖 Initializing VLM model (singleton)...")
-                vlm = OptimizedVLM()
-                print("✅ VLM model ready for use!")
-    return vlm
+            backend = _backends.get(tier)
+            if backend is None:  # Double-check locking pattern
+                print(f"🤖 Initializing {tier} tier model (singleton)...")
+                backend = TIERS[tier]()
+                _backends[tier] = backend
+                print(f"✅ {tier} tier model ready for use!")
+    return backend
+
+
+def loaded_backends() -> dict:
+    """Tiers whose models are already loaded"""
+    return dict(_backends)
@@ -0,0 +1,190 @@
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+import asyncio, threading, time
+from typing import Optional
+from settings import settings
+from inference import TIERS, get_vlm, loaded_backends
+from scheduler import InferenceScheduler
+from cache import content_hash
+
+# The one process on a host that holds the model: the worker serves it on
+# settings.inference_service_port, and the API forwards /v1/preview here.
+app = FastAPI(title="Renamer AI Inference Service")
+
+# Default-tier backend, set once loaded and warmed up
+vlm_instance = None
+# "loading" until the model has loaded and warmed up, then "ready" (or "failed")
+model_state = "loading"
+# Why loading failed, reported by /health
+model_error: Optional[str] = None
+model_load_task = None
+# Micro-batches concurrent preview requests into shared GPU batches (one scheduler per tier)
+preview_schedulers = {}
+
+
+async def start_loading():
+    """Start loading and warming the default tier in the background"""
+    global model_state, model_load_task
+    if model_load_task is None:
+        model_state = "loading"
+        model_load_task = asyncio.create_task(load_model())
+
+
+async def load_model():
+    """Load and warm up the default tier off the event loop, then open its preview scheduler"""
+    global vlm_instance, model_state, model_error
+    print("🤖 Loading VLM model for previews...")
+    try:
+        backend = await asyncio.get_event_loop().run_in_executor(None, get_vlm)
+        # A preview request may already have opened the default tier's scheduler
+        if settings.default_tier not in preview_schedulers:
+            scheduler = InferenceScheduler(backend)
+            scheduler.start()
+            preview_schedulers[settings.default_tier] = scheduler
+        vlm_instance = backend
+        model_state = "ready"
+        print("✅ VLM model loaded and warmed up - previews ready!")
+    except Exception as e:
+        print(f"❌ Failed to load VLM model: {e}")
+        print("⚠️ Inference service running without VLM model - previews will fail")
+        vlm_instance = None
+        model_state = "failed"
+        model_error = str(e)
+
+
+async def stop():
+    """Stop the preview schedulers"""
+    for scheduler in preview_schedulers.values():
+        await scheduler.stop()
+
+
+async def get_preview_scheduler(tier: Optional[str]) -> InferenceScheduler:
+    """Preview scheduler for a tier, loading that tier's model off the event loop on first use"""
+    tier = tier or settings.default_tier
+    if tier not in TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier '{tier}' (expected one of: {', '.join(TIERS)})")
+    scheduler = preview_schedulers.get(tier)
+    if scheduler is None:
+        try:
+            backend = await asyncio.get_event_loop().run_in_executor(None, get_vlm, tier)
+        except Exception as e:
+            print(f"❌ Failed to load {tier} tier: {e}")
+            raise HTTPException(status_code=503, detail=f"Tier '{tier}' unavailable: {str(e)}")
+        scheduler = preview_schedulers.get(tier)
+        if scheduler is None:
+            scheduler = InferenceScheduler(backend)
+            scheduler.start()
+            preview_schedulers[tier] = scheduler
+    return scheduler
+
+
+async def preview(image_bytes: bytes, prompt: str, tier: Optional[str] = None) -> dict:
+    """Suggested name for one image through the result cache and the tier's micro-batcher"""
+    if vlm_instance is None:
+        print("❌ VLM instance is None")
+        raise HTTPException(status_code=503, detail="Model not ready yet, please wait")
+
+    scheduler = await get_preview_scheduler(tier)
+    backend = scheduler.vlm
+    try:
+        # Check the result cache, then decode off the event loop and join the next micro-batch
+        start_time = time.time()
+        loop = asyncio.get_event_loop()
+        image_hash = content_hash(image_bytes)
+        suggested_name = await loop.run_in_executor(
+            backend.thread_pool, backend.cached_result, image_hash, prompt
+        )
+        if suggested_name is None:
+            img = await loop.run_in_executor(
+                backend.thread_pool, backend.preprocess_img, image_bytes, image_hash
+            )
+            suggested_name = await scheduler.predict(img, prompt, image_hash)
+        processing_time = time.time() - start_time
+        return {
+            "suggested": suggested_name,
+            "tier": backend.tier,
+            "processing_time_ms": int(processing_time * 1000)
+        }
+    except Exception as e:
+        print(f"❌ Preview error: {e}")
+        raise HTTPException(status_code=400, detail=f"Preview failed: {str(e)}")
+
+
+def health_report() -> tuple:
+    """(HTTP status, body): 503 until the model is loaded and warmed up, and if loading failed"""
+    vlm_ready = vlm_instance is not None and vlm_instance.ready
+    if not vlm_ready:
+        return 503, {
+            "status": "warming" if model_state == "loading" else "unavailable",
+            "timestamp": time.time(),
+            "model_state": model_state,
+            "error": model_error,
+            "vlm_ready": False,
+            "model_loaded": vlm_instance is not None
+        }
+    preview_scheduler = preview_schedulers.get(settings.default_tier)
+    return 200, {
+        "status": "ok",
+        "timestamp": time.time(),
+        "model_state": model_state,
+        "vlm_ready": vlm_ready,
+        "model_loaded": vlm_instance is not None,
+        "preview_scheduler": preview_scheduler.stats() if preview_scheduler is not None else None,
+        "result_cache": vlm_instance.result_cache.stats() if vlm_ready and vlm_instance.result_cache else None,
+        "vision_cache": vlm_instance.vision_cache.stats() if vlm_ready and vlm_instance.vision_cache else None,
+        "prefix_cache": vlm_instance.prefix_cache.stats() if vlm_ready and vlm_instance.prefix_cache else None,
+        "speculative": vlm_instance.speculative.stats() if vlm_ready and vlm_instance.speculative else None,
+        "image_cache": vlm_instance.image_cache_stats() if vlm_ready else None,
+        "decode": vlm_instance.decode_stats() if vlm_ready else None,
+        "autotune": vlm_instance.autotuner.report() if vlm_ready else None,
+        "startup": vlm_instance.startup.as_dict() if vlm_ready else None,
+        "warmup": vlm_instance.warmup_report if vlm_ready else None,
+        "tiers": {
+            tier: {
+                "model_id": backend.model_id,
+                "ready": backend.ready,
+                "warmup": backend.warmup_report,
+                "throughput": backend.throughput.as_dict(),
+                "preview_scheduler": preview_schedulers[tier].stats() if tier in preview_schedulers else None
+            }
+            for tier, backend in loaded_backends().items()
+        }
+    }
+
+
+@app.on_event("startup")
+async def startup_event():
+    await start_loading()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop()
+
+
+@app.get("/health")
+async def health():
+    status_code, body = health_report()
+    return JSONResponse(status_code=status_code, content=body)
+
+
+@app.post("/v1/preview")
+async def preview_endpoint(file: UploadFile = File(...), prompt: str = Form(""), tier: str = Form("")):
+    """Internal preview endpoint called by the API (not exposed outside the host network)"""
+    return await preview(await file.read(), prompt, tier or None)
+
+
+def serve_in_background() -> Optional[threading.Thread]:
+    """Serve this app from a daemon thread of the calling process (the worker), so previews
+    and jobs share the process's single model copy; None when the port is disabled"""
+    if not settings.inference_service_port:
+        return None
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="0.0.0.0", port=settings.inference_service_port, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, name="inference-service", daemon=True)
+    thread.start()
+    print(f"🛰️ Inference service listening on port {settings.inference_service_port}")
+    return thread
@@ -0,0 +1,102 @@
+import json
+import time
+from typing import Any, Dict, Optional
+from settings import settings
+from cache import async_redis
+
+# One Redis hash per job, updated with atomic increments as items finish, so progress
+# polls cost a single round trip however large the job:
+#   job_status:{job_id}   total, succeeded, errors, state, tier, shards, *_at timings
+#   job_latest:{job_id}   the last few finished results (capped list)
+LATEST_RESULTS = 5
+_TEXT_FIELDS = ("state", "tier", "error")
+
+
+def _status_key(job_id: str) -> str:
+    return f"job_status:{job_id}"
+
+
+def _latest_key(job_id: str) -> str:
+    return f"job_latest:{job_id}"
+
+
+class JobStatusStore:
+    """Per-job status record; every method degrades to a warning when Redis is down"""
+
+    async def create(self, job_id: str, total: int, tier: str, shards: int = 1):
+        await self._write(job_id, lambda pipe: pipe.hset(_status_key(job_id), mapping={
+            "state": "queued",
+            "total": total,
+            "succeeded": 0,
+            "errors": 0,
+            "tier": tier,
+            "shards": shards,
+            "created_at": time.time()
+        }))
+
+    async def start(self, job_id: str):
+        now = time.time()
+
+        def ops(pipe):
+            pipe.hsetnx(_status_key(job_id), "started_at", now)
+            pipe.hset(_status_key(job_id), mapping={"state": "processing", "updated_at": now})
+        await self._write(job_id, ops)
+
+    async def item_finished(self, job_id: str, result: Dict[str, Any]) -> Optional[int]:
+        """Count one finished item and remember it among the latest results; returns the
+        items finished job-wide (all shards), None if Redis is down"""
+        field = "succeeded" if result.get("status") == "completed" else "errors"
+
+        def ops(pipe):
+            pipe.hincrby(_status_key(job_id), field, 1)
+            pipe.hmget(_status_key(job_id), "succeeded", "errors")
+            pipe.hset(_status_key(job_id), "updated_at", time.time())
+            pipe.lpush(_latest_key(job_id), json.dumps(result))
+            pipe.ltrim(_latest_key(job_id), 0, LATEST_RESULTS - 1)
+            pipe.expire(_latest_key(job_id), settings.job_state_ttl_seconds)
+        replies = await self._write(job_id, ops)
+        if replies is None:
+            return None
+        return sum(int(count or 0) for count in replies[1])
+
+    async def finish(self, job_id: str, state: str, **fields):
+        """Final state; counts passed here replace the running (possibly redelivery-inflated) ones"""
+        now = time.time()
+        await self._write(job_id, lambda pipe: pipe.hset(_status_key(job_id), mapping={
+            "state": state, "finished_at": now, "updated_at": now, **fields
+        }))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status record plus latest results in one round trip; None if unknown"""
+        try:
+            pipe = async_redis().pipeline(transaction=False)
+            pipe.hgetall(_status_key(job_id))
+            pipe.lrange(_latest_key(job_id), 0, LATEST_RESULTS - 1)
+            record, latest = await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Job status read failed for {job_id}: {e}")
+            return None
+        if not record:
+            return None
+        status = {key: value if key in _TEXT_FIELDS else _number(value) for key, value in record.items()}
+        status["latest_results"] = [json.loads(result) for result in reversed(latest)]
+        return status
+
+    async def _write(self, job_id: str, ops) -> Optional[list]:
+        """Run ``ops`` on a transaction pipeline; the replies, None if Redis failed"""
+        try:
+            pipe = async_redis().pipeline(transaction=True)
+            ops(pipe)
+            pipe.expire(_status_key(job_id), settings.job_state_ttl_seconds)
+            return await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Job status update failed for {job_id}: {e}")
+            return None
+
+
+def _number(value: str):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+job_status = JobStatusStore()
@@ -0,0 +1,361 @@
+import heapq
+import json
+import sys
+import time
+import uuid
+from array import array
+from typing import Any, Dict, List, Optional
+from settings import settings
+from naming import dedupe
+from cache import connect_redis
+
+# While a job runs, finished results are appended as small sorted "part" objects:
+#   demo/jobs/{job_id}/parts/{order}-{first_index}-{last_index}-{writer}-{seq}.jsonl
+# The part listing is the index: keys sort by write order (so clients can page with a
+# cursor) and name the index range each part covers (so the final manifest can be
+# assembled in index order while holding only overlapping parts in memory).
+#
+# ``order`` is a job-wide sequence number from Redis (1, 2, 3, ... across shards), so a
+# reader can tell a part still being uploaded from one that is simply not there. Without
+# Redis it falls back to the writer's clock in milliseconds, and paging partial results
+# by cursor is best-effort: a part written with an earlier timestamp that lands after a
+# later one (clock skew, a slow PUT) can fall behind a client's cursor.
+_SEQUENCE_LIMIT = 10 ** 12  # Sequence numbers stay below this; millisecond timestamps are above it
+
+# Next to the finished manifest, small binary indexes allow paging with S3 ranged reads:
+#   manifest.idx             big-endian uint64 byte offset of each line, plus end + 1
+#   manifest.{status}.idx    big-endian uint64 (start, end) byte range of each line with that status
+INDEXED_STATUSES = ("completed", "error")
+
+# S3 multipart uploads need every part but the last to be at least 5MB
+_UPLOAD_PART_BYTES = 8 * 1024 * 1024
+
+# Ranged reads of filtered lines closer together than this are merged into one request
+_COALESCE_GAP_BYTES = 64 * 1024
+
+
+def manifest_key(job_id: str) -> str:
+    return f"demo/jobs/{job_id}/manifest.jsonl"
+
+
+def index_key(job_id: str, status: Optional[str] = None) -> str:
+    return f"demo/jobs/{job_id}/manifest.{status}.idx" if status else f"demo/jobs/{job_id}/manifest.idx"
+
+
+def parts_prefix(job_id: str) -> str:
+    return f"demo/jobs/{job_id}/parts/"
+
+
+def part_order(key: str) -> int:
+    """Write order number of a part key (sequence number or millisecond timestamp)"""
+    return int(key.rsplit("/", 1)[-1].split("-")[0])
+
+
+def part_range(key: str) -> tuple:
+    """(first index, last index) covered by a part key"""
+    fields = key.rsplit("/", 1)[-1].split("-")
+    return int(fields[1]), int(fields[2])
+
+
+def list_parts(s3, job_id: str, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+    """Part keys in write order, optionally after a cursor (a part key's file name)"""
+    return [obj["Key"] for obj in _list_part_objects(s3, job_id, after, limit)]
+
+
+def list_readable_parts(s3, job_id: str, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+    """Part keys after a cursor that can be handed out without skipping one still in flight.
+
+    Stops before a gap in the sequence numbers (a part still being uploaded) unless the
+    part after the gap is older than ``results_part_gap_seconds``, in which case the
+    missing part is taken to be abandoned by a writer that died.
+    """
+    expected = part_order(after) + 1 if after else 1
+    cutoff = time.time() - settings.results_part_gap_seconds
+    keys: List[str] = []
+    for obj in _list_part_objects(s3, job_id, after, limit):
+        order = part_order(obj["Key"])
+        if expected < order < _SEQUENCE_LIMIT and obj["LastModified"].timestamp() > cutoff:
+            break
+        keys.append(obj["Key"])
+        expected = order + 1
+    return keys
+
+
+def _list_part_objects(s3, job_id: str, after: Optional[str], limit: Optional[int]) -> List[dict]:
+    objects: List[dict] = []
+    kwargs = {"Bucket": settings.s3_out_bucket, "Prefix": parts_prefix(job_id)}
+    if after:
+        kwargs["StartAfter"] = parts_prefix(job_id) + after
+    while True:
+        page = s3.list_objects_v2(**kwargs)
+        objects.extend(page.get("Contents", []))
+        if not page.get("IsTruncated") or (limit and len(objects) >= limit):
+            return objects[:limit] if limit else objects
+        kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+def read_part(s3, key: str) -> List[Dict[str, Any]]:
+    body = s3.get_object(Bucket=settings.s3_out_bucket, Key=key)["Body"].read().decode("utf-8")
+    return [json.loads(line) for line in body.split("\n") if line]
+
+
+def delete_parts(s3, job_id: str):
+    """Drop a job's parts once its manifest is written"""
+    keys = list_parts(s3, job_id)
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=settings.s3_out_bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]]}
+        )
+
+
+class PartSequence:
+    """Job-wide part order numbers from a Redis counter, shared by every shard's writer"""
+
+    def __init__(self):
+        self.client = connect_redis("manifest part ordering, ordering parts by write time")
+
+    def next(self, job_id: str) -> int:
+        """Next part number of a job, or the current time in ms without Redis"""
+        if self.client is not None:
+            try:
+                key = f"job_parts_seq:{job_id}"
+                pipe = self.client.pipeline()
+                pipe.incr(key)
+                pipe.expire(key, settings.job_state_ttl_seconds)
+                return pipe.execute()[0]
+            except Exception as e:
+                print(f"⚠️ Part sequence failed for job {job_id} ({e}), ordering parts by write time")
+        return int(time.time() * 1000)
+
+
+class ManifestWriter:
+    """Buffers one pipeline's finished results and flushes them as parts.
+
+    Items are checkpointed only once their part is in S3, so every checkpointed item
+    is in some part; a crash loses at most one unflushed buffer of work.
+    """
+
+    def __init__(self, s3, job_id: str, writer: str, checkpoint=None,
+                 sequence: Optional[PartSequence] = None):
+        self.s3 = s3
+        self.job_id = job_id
+        # Unique per delivery, so a redelivered job never overwrites earlier parts
+        self.writer = f"{writer}{uuid.uuid4().hex[:6]}"
+        self.checkpoint = checkpoint
+        self.sequence = sequence
+        self.buffer: List[Dict[str, Any]] = []
+        self.parts_written = 0
+
+    def add(self, result: Dict[str, Any]) -> bool:
+        """Buffer a result; True when the buffer is full and should be flushed"""
+        self.buffer.append(result)
+        return len(self.buffer) >= settings.manifest_part_size
+
+    def flush(self):
+        if not self.buffer:
+            return
+        results = sorted(self.buffer, key=lambda r: r["index"])
+        order = self.sequence.next(self.job_id) if self.sequence is not None else int(time.time() * 1000)
+        key = (f"{parts_prefix(self.job_id)}{order:013d}-{results[0]['index']:07d}-"
+               f"{results[-1]['index']:07d}-{self.writer}-{self.parts_written:05d}.jsonl")
+        self.s3.put_object(
+            Bucket=settings.s3_out_bucket,
+            Key=key,
+            Body="\n".join(json.dumps(result) for result in results).encode("utf-8"),
+            ContentType="application/jsonl"
+        )
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.job_id, results)
+        self.parts_written += 1
+        self.buffer = []
+
+
+class _ManifestUpload:
+    """Writes manifest lines to S3 in bounded memory: one put_object for small
+    manifests, a multipart upload of ~8MB parts for large ones"""
+
+    def __init__(self, s3, key: str):
+        self.s3 = s3
+        self.key = key
+        self.chunks: List[bytes] = []
+        self.buffered = 0
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = []
+        self.first = True
+        self.position = 0
+
+    def write_line(self, line: str) -> tuple:
+        """Append a line; returns its (start, end) byte range in the manifest"""
+        data = (line if self.first else "\n" + line).encode("utf-8")
+        start = self.position if self.first else self.position + 1
+        self.first = False
+        self.chunks.append(data)
+        self.buffered += len(data)
+        self.position += len(data)
+        if self.buffered >= _UPLOAD_PART_BYTES:
+            self._upload_part()
+        return start, self.position
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=settings.s3_out_bucket, Key=self.key, ContentType="application/jsonl"
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=settings.s3_out_bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=b"".join(self.chunks)
+        )
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        self.chunks, self.buffered = [], 0
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(
+                Bucket=settings.s3_out_bucket, Key=self.key,
+                Body=b"".join(self.chunks), ContentType="application/jsonl"
+            )
+            return
+        if self.chunks:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=settings.s3_out_bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=settings.s3_out_bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def assemble_manifest(s3, job_id: str, keep_results: int = 0) -> Dict[str, Any]:
+    """Merge a job's parts into manifest.jsonl in index order, deduplicating names
+    across the whole job (shards, redeliveries) and keeping each index once.
+
+    Parts are loaded in order of their first index; results below the next part's
+    first index can no longer be preceded by anything, so they are written out and
+    dropped. Returns counts, plus the results themselves if there are at most
+    ``keep_results`` of them.
+    """
+    keys = sorted(list_parts(s3, job_id), key=part_range)
+    upload = _ManifestUpload(s3, manifest_key(job_id))
+    heap: List[tuple] = []
+    offsets = array("Q")
+    status_ranges = {status: array("Q") for status in INDEXED_STATUSES}
+    names = set()
+    last_index = -1
+    summary = {"completed": 0, "errors": 0, "total_processing_time": 0}
+    kept: List[Dict[str, Any]] = []
+
+    def emit(below: Optional[int]):
+        nonlocal last_index
+        while heap and (below is None or heap[0][0] < below):
+            index, _, result = heapq.heappop(heap)
+            if index == last_index:
+                continue  # Also written by an earlier, interrupted delivery
+            last_index = index
+            if result.get("status") == "completed":
+                stem, dot, ext = result["suggested"].rpartition(".")
+                final_name = dedupe(stem if dot else ext, names)
+                result["suggested"] = f"{final_name}.{ext}" if dot else final_name
+                summary["completed"] += 1
+            else:
+                summary["errors"] += 1
+            summary["total_processing_time"] += result.get("processing_time_ms", 0)
+            start, end = upload.write_line(json.dumps(result))
+            offsets.append(start)
+            if result.get("status") in status_ranges:
+                status_ranges[result["status"]].extend((start, end))
+            if len(kept) <= keep_results:
+                kept.append(result)
+
+    try:
+        for seq, key in enumerate(keys):
+            emit(part_range(key)[0])
+            for result in read_part(s3, key):
+                heapq.heappush(heap, (result["index"], seq, result))
+        emit(None)
+        upload.close()
+    except BaseException:
+        upload.abort()
+        raise
+
+    # Offsets are 8 bytes per line, small next to the manifest itself
+    offsets.append(upload.position + 1)
+    _put_index(s3, index_key(job_id), offsets)
+    for status, ranges in status_ranges.items():
+        _put_index(s3, index_key(job_id, status), ranges)
+
+    if len(kept) <= keep_results:
+        summary["results"] = kept
+    return summary
+
+
+def _put_index(s3, key: str, values: array):
+    if sys.byteorder == "little":
+        values.byteswap()
+    s3.put_object(Bucket=settings.s3_out_bucket, Key=key, Body=values.tobytes(),
+                  ContentType="application/octet-stream")
+
+
+def _read_uint64(s3, key: str, first: int, count: int) -> List[int]:
+    """``count`` big-endian uint64 values of an index object, starting at entry ``first``"""
+    if count <= 0:
+        return []
+    body = _read_range(s3, key, first * 8, (first + count) * 8)
+    values = array("Q", body)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values.tolist()
+
+
+def _read_range(s3, key: str, start: int, end: int) -> bytes:
+    """Bytes [start, end) of an object"""
+    return s3.get_object(
+        Bucket=settings.s3_out_bucket, Key=key, Range=f"bytes={start}-{end - 1}"
+    )["Body"].read()
+
+
+def index_info(s3, job_id: str, status: Optional[str] = None) -> Optional[dict]:
+    """ETag and entry count of a finished job's index, None if it has none"""
+    try:
+        head = s3.head_object(Bucket=settings.s3_out_bucket, Key=index_key(job_id, status))
+    except Exception as e:
+        if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    entry_bytes = 16 if status else 8
+    # The full index carries one extra end-of-manifest offset
+    total = head["ContentLength"] // entry_bytes - (0 if status else 1)
+    return {"etag": head["ETag"].strip('"'), "total": max(0, total)}
+
+
+def read_page(s3, job_id: str, offset: int, limit: int, status: Optional[str], total: int) -> List[Dict[str, Any]]:
+    """Manifest lines [offset, offset + limit) (of those with ``status``, if given) via ranged reads"""
+    count = max(0, min(limit, total - offset))
+    if count == 0:
+        return []
+    key = manifest_key(job_id)
+    if status is None:
+        # Contiguous lines: one read of the offsets, one read of the manifest
+        bounds = _read_uint64(s3, index_key(job_id), offset, count + 1)
+        body = _read_range(s3, key, bounds[0], bounds[-1] - 1)
+        return [json.loads(line) for line in body.decode("utf-8").split("\n")]
+
+    flat = _read_uint64(s3, index_key(job_id, status), offset * 2, count * 2)
+    ranges = list(zip(flat[0::2], flat[1::2]))
+    groups: List[List[tuple]] = [[ranges[0]]]
+    for line_range in ranges[1:]:
+        if line_range[0] - groups[-1][-1][1] <= _COALESCE_GAP_BYTES:
+            groups[-1].append(line_range)
+        else:
+            groups.append([line_range])
+
+    results = []
+    for group in groups:
+        base = group[0][0]
+        body = _read_range(s3, key, base, group[-1][1])
+        for start, end in group:
+            results.append(json.loads(body[start - base:end - base].decode("utf-8")))
+    return results
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import time
+from typing import Optional
+from settings import settings
+
+# Written last, so a directory without it is an incomplete materialization
+ARTIFACT_MANIFEST = "materialized.json"
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, ARTIFACT_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def baked_quantization(device: str) -> Optional[str]:
+    """Quantization stored in the weights themselves (BitsAndBytes only exists on CUDA)"""
+    if device == "cuda" and settings.quantization in ("8bit", "4bit"):
+        return settings.quantization
+    return None
+
+
+def usable_artifact(device: str) -> Optional[str]:
+    """settings.model_artifact_dir if it holds a complete checkpoint for the configured model"""
+    path = settings.model_artifact_dir
+    if not path:
+        return None
+    manifest = read_manifest(path)
+    if manifest is None:
+        print(f"⚠️ No materialized checkpoint in {path}, loading {settings.model_id}")
+        return None
+    expected = {"model_id": settings.model_id, "quantization": baked_quantization(device)}
+    actual = {key: manifest.get(key) for key in expected}
+    if actual != expected:
+        print(f"⚠️ Materialized checkpoint in {path} is {actual}, need {expected}; loading {settings.model_id}")
+        return None
+    return path
+
+
+def materialize(output_dir: str) -> dict:
+    """Save the processor and the already-quantized quality model as local safetensors"""
+    import torch
+    import transformers
+    from transformers import AutoProcessor
+    from inference import load_model
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    start = time.perf_counter()
+    print(f"📥 Loading {settings.model_id} ({baked_quantization(device) or 'unquantized'}) on {device}...")
+    processor = AutoProcessor.from_pretrained(settings.model_id)
+    model, quantization = load_model(settings.model_id, device)
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, ARTIFACT_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    print(f"💾 Saving to {output_dir}...")
+    processor.save_pretrained(output_dir)
+    model.save_pretrained(output_dir, safe_serialization=True)
+
+    manifest = {
+        "model_id": settings.model_id,
+        "quantization": quantization,
+        "device": torch.cuda.get_device_name(0) if device == "cuda" else "cpu",
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "created_at": time.time()
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Materialized in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+if __name__ == "__main__":
+    # One-off: python3 materialize.py [--output DIR], then set MODEL_ARTIFACT_DIR=DIR
+    parser = argparse.ArgumentParser(description="Save a pre-quantized, memory-mappable model checkpoint")
+    parser.add_argument("--output", default=settings.model_artifact_dir or "./model_artifact")
+    args = parser.parse_args()
+    print(json.dumps(materialize(args.output), indent=2))
@@ -0,0 +1,318 @@
+import asyncio
+import time
+from typing import Dict, Any, List, Callable, Awaitable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from settings import settings
+from naming import dedupe
+from cache import content_hash
+from scheduler import InferenceScheduler, get_within
+from checkpoint import JobCheckpoint
+from manifest import ManifestWriter, PartSequence
+
+# Queue sentinel marking the end of a stage's input
+_DONE = object()
+
+
+def error_result(index: int, file_key: str, error_msg: str) -> Dict[str, Any]:
+    """Build the manifest entry for a file that could not be processed"""
+    return {
+        "index": index,
+        "original": file_key.split('/')[-1],
+        "suggested": None,
+        "error": error_msg,
+        "status": "error",
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def completed_result(index: int, file_key: str, final_name: str, processing_time: float, batch_size: int) -> Dict[str, Any]:
+    """Build the manifest entry for a successfully renamed file"""
+    # Determine file extension from original
+    original_filename = file_key.split('/')[-1]
+    original_ext = original_filename.split('.')[-1] if '.' in original_filename else 'jpg'
+    return {
+        "index": index,
+        "original": original_filename,
+        "suggested": f"{final_name}.{original_ext}",
+        "processing_time_ms": int(processing_time * 1000),
+        "batch_size": batch_size,
+        "status": "completed",
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+class JobPipeline:
+    """Streaming job pipeline: S3 fetch -> decode/resize -> GPU inference -> result write.
+
+    Stages run concurrently and are connected by bounded queues, so network I/O and
+    CPU decoding overlap with GPU work while at most ``pipeline_queue_size`` items
+    wait between any two stages, regardless of job size.
+    """
+
+    def __init__(self, job_id: str, file_keys: List[str], user_prompt: str, vlm, s3,
+                 send_update: Callable[..., Awaitable[None]],
+                 download_executor: ThreadPoolExecutor, scheduler: InferenceScheduler,
+                 index_offset: int = 0, dedupe_names: bool = True,
+                 checkpoint: Optional[JobCheckpoint] = None, total_items: Optional[int] = None,
+                 part_sequence: Optional[PartSequence] = None):
+        self.job_id = job_id
+        self.file_keys = file_keys
+        self.user_prompt = user_prompt
+        self.vlm = vlm
+        self.s3 = s3
+        self.send_update = send_update
+        self.download_executor = download_executor
+        # Shared by every job running on this worker, so small jobs fill each other's GPU batches
+        self.scheduler = scheduler
+        self.batch_size = vlm._get_dynamic_batch_size(len(file_keys))
+        # Shards of a split job report job-wide indices and totals and leave deduplication to the fan-in
+        self.index_offset = index_offset
+        self.total_items = total_items or len(file_keys)
+        self.dedupe_names = dedupe_names
+        # Finished items survive redelivery; failed items are retried up to item_max_attempts
+        self.checkpoint = checkpoint
+        self._retry: List[tuple] = []
+
+        # Results go to S3 parts as they finish; only counts and names stay in memory
+        self.manifest = ManifestWriter(s3, job_id, f"{index_offset:07d}", checkpoint, part_sequence)
+        self.finished = 0
+        self.existing_names = set()
+
+    async def run(self):
+        """Run all stages to completion, leaving every result in the job's manifest parts.
+
+        Items checkpointed by an earlier delivery are not processed again; items that
+        fail are rerun in further passes until they succeed or run out of attempts.
+        """
+        items = list(enumerate(self.file_keys, self.index_offset))
+        resumed = await self._resume()
+        pending = [(index, file_key) for index, file_key in items if index not in resumed]
+        if resumed:
+            print(f"⏩ Job {self.job_id}: {len(resumed)}/{len(items)} items already done, processing {len(pending)}")
+
+        while pending:
+            self._retry = []
+            await self._run_pass(pending)
+            pending = self._retry
+            if pending:
+                print(f"🔁 Job {self.job_id}: retrying {len(pending)} failed items")
+
+        await asyncio.get_event_loop().run_in_executor(self.download_executor, self.manifest.flush)
+
+    async def _resume(self) -> set:
+        """Indices of this pipeline's items already in the job's parts, per the checkpoint"""
+        if self.checkpoint is None:
+            return set()
+        loop = asyncio.get_event_loop()
+        finished = await loop.run_in_executor(
+            self.download_executor, self.checkpoint.load, self.job_id,
+            self.index_offset, self.index_offset + len(self.file_keys)
+        )
+        resumed = set(finished)
+        for suggested in finished.values():
+            if suggested:
+                self.existing_names.add(suggested.rpartition(".")[0] or suggested)
+        self.finished = len(resumed)
+        return resumed
+
+    async def _run_pass(self, items: List[tuple]):
+        """One pass of every stage over ``items`` (index, file_key)"""
+        fetch_q = asyncio.Queue()
+        decode_q = asyncio.Queue(maxsize=settings.pipeline_queue_size)
+        infer_q = asyncio.Queue(maxsize=settings.pipeline_queue_size)
+        write_q = asyncio.Queue(maxsize=settings.pipeline_queue_size)
+
+        for item in items:
+            fetch_q.put_nowait(item)
+
+        fetchers = [asyncio.create_task(self._fetch_stage(fetch_q, decode_q, write_q))
+                    for _ in range(settings.fetch_workers)]
+        decoders = [asyncio.create_task(self._decode_stage(decode_q, infer_q, write_q))
+                    for _ in range(settings.decode_workers)]
+        inferer = asyncio.create_task(self._infer_stage(infer_q, write_q))
+        writer = asyncio.create_task(self._write_stage(write_q))
+
+        stages = fetchers + decoders + [inferer, writer]
+        closer = asyncio.create_task(self._close_stages(fetchers, decoders, inferer, writer, decode_q, infer_q, write_q))
+        try:
+            # A failed stage stops draining its queue, so upstream stages would block on it
+            # for good: the first failure cancels every other stage and is raised here
+            done, _ = await asyncio.wait(stages + [closer], return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in stages + [closer]:
+                task.cancel()
+            await asyncio.gather(*stages, closer, return_exceptions=True)
+
+    async def _close_stages(self, fetchers, decoders, inferer, writer, decode_q, infer_q, write_q):
+        """Shut stages down in order, each once every upstream worker has drained"""
+        await asyncio.gather(*fetchers)
+        for _ in decoders:
+            await decode_q.put(_DONE)
+        await asyncio.gather(*decoders)
+        await infer_q.put(_DONE)
+        await inferer
+        await write_q.put(_DONE)
+        await writer
+
+    async def _fetch_stage(self, fetch_q: asyncio.Queue, decode_q: asyncio.Queue, write_q: asyncio.Queue):
+        """Download raw image bytes from S3"""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                index, file_key = fetch_q.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            await self.send_update(self.job_id, "item_processing", {
+                "index": index,
+                "filename": file_key.split('/')[-1],
+                "status": "downloading"
+            })
+            try:
+                print(f"📥 Processing file {index+1}: {file_key}")
+                image_bytes = await loop.run_in_executor(self.download_executor, self._download, file_key)
+            except Exception as e:
+                print(f"❌ Error downloading file {index+1}: {e}")
+                await write_q.put(error_result(index, file_key, str(e)))
+                continue
+            await decode_q.put((index, file_key, image_bytes))
+
+    def _download(self, file_key: str) -> bytes:
+        response = self.s3.get_object(Bucket=settings.s3_in_bucket, Key=file_key)
+        return response['Body'].read()
+
+    async def _decode_stage(self, decode_q: asyncio.Queue, infer_q: asyncio.Queue, write_q: asyncio.Queue):
+        """Decode and resize images on the VLM preprocessing pool"""
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await decode_q.get()
+            if item is _DONE:
+                return
+            index, file_key, image_bytes = item
+            try:
+                image_hash, cached = await loop.run_in_executor(self.vlm.thread_pool, self._lookup, image_bytes)
+                if cached is not None:
+                    # Result cache hit: skip decode and inference entirely
+                    await write_q.put((index, file_key, cached, 0.0, 0))
+                    continue
+                img = await loop.run_in_executor(self.vlm.thread_pool, self.vlm.preprocess_img, image_bytes, image_hash)
+            except Exception as e:
+                print(f"❌ Error decoding file {index+1}: {e}")
+                await write_q.put(error_result(index, file_key, str(e)))
+                continue
+            await infer_q.put((index, file_key, img, image_hash))
+
+    def _lookup(self, image_bytes: bytes) -> tuple:
+        image_hash = content_hash(image_bytes)
+        return image_hash, self.vlm.cached_result(image_hash, self.user_prompt)
+
+    async def _infer_stage(self, infer_q: asyncio.Queue, write_q: asyncio.Queue):
+        """Collect decoded images into visual-token buckets and run them as GPU batches"""
+        window_size = self.batch_size * max(1, settings.bucket_window_batches)
+        done = False
+        while not done:
+            item = await infer_q.get()
+            if item is _DONE:
+                return
+            window = [item]
+
+            # Wait briefly to fill one batch, then take whatever else is already queued
+            deadline = time.monotonic() + settings.batch_wait_ms / 1000
+            while len(window) < window_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if len(window) < self.batch_size and timeout > 0:
+                        item = await get_within(infer_q, timeout)
+                    else:
+                        item = infer_q.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                window.append(item)
+
+            # Group images of similar visual-token count to cut padded compute
+            images = [img for _, _, img, _ in window]
+            prompts = [self.user_prompt] * len(window)
+            for batch_indices in self.vlm.plan_batches(images, prompts, self.batch_size):
+                for entry in await self._run_batch([window[i] for i in batch_indices]):
+                    await write_q.put(entry)
+
+    async def _run_batch(self, batch: List[tuple]) -> List[tuple]:
+        """Submit one planned batch to the shared scheduler; failures stay per item"""
+        for index, file_key, _, _ in batch:
+            await self.send_update(self.job_id, "item_processing", {
+                "index": index,
+                "filename": file_key.split('/')[-1],
+                "status": "ai_processing"
+            })
+
+        images = [img for _, _, img, _ in batch]
+        prompts = [self.user_prompt] * len(batch)
+        image_hashes = [image_hash for _, _, _, image_hash in batch]
+
+        start_time = time.time()
+        suggestions = await self.scheduler.predict_many(images, prompts, image_hashes)
+        # Amortize batch latency over its items
+        per_item_time = (time.time() - start_time) / len(batch)
+
+        entries = []
+        for (index, file_key, _, _), name in zip(batch, suggestions):
+            if isinstance(name, Exception):
+                print(f"❌ Error processing file {index+1}: {name}")
+                entries.append(error_result(index, file_key, str(name)))
+            else:
+                entries.append((index, file_key, name, per_item_time, len(batch)))
+        return entries
+
+    async def _write_stage(self, write_q: asyncio.Queue):
+        """Deduplicate names, append results to the manifest parts and publish per-item completion"""
+        loop = asyncio.get_event_loop()
+        while True:
+            entry = await write_q.get()
+            if entry is _DONE:
+                return
+
+            if isinstance(entry, dict):
+                result = entry
+                if await self._retry_later(result):
+                    continue
+            else:
+                index, file_key, name, processing_time, batch_size = entry
+                final_name = dedupe(name, self.existing_names) if self.dedupe_names else name
+                result = completed_result(index, file_key, final_name, processing_time, batch_size)
+                print(f"✅ Completed {index+1}: {result['original']} → {result['suggested']}")
+
+            self.finished += 1
+            if self.manifest.add(result):
+                await loop.run_in_executor(self.download_executor, self.manifest.flush)
+            await self.send_update(self.job_id, "item_complete", {
+                "result": result,
+                "progress": {"completed": self.finished, "total": self.total_items}
+            })
+
+    async def _retry_later(self, result: Dict[str, Any]) -> bool:
+        """Count a failed attempt; True if the item gets another pass instead of its error"""
+        if self.checkpoint is None:
+            return False
+        index = result["index"]
+        loop = asyncio.get_event_loop()
+        attempts = await loop.run_in_executor(
+            self.download_executor, self.checkpoint.record_failure, self.job_id, index
+        )
+        result["attempts"] = attempts
+        if attempts >= settings.item_max_attempts:
+            return False
+        self._retry.append((index, self.file_keys[index - self.index_offset]))
+        await self.send_update(self.job_id, "item_processing", {
+            "index": index,
+            "filename": result["original"],
+            "status": "retrying",
+            "attempt": attempts + 1
+        })
+        return True
@@ -0,0 +1,100 @@
+import copy
+import threading
+from typing import Optional
+import torch
+from transformers import DynamicCache
+
+
+class SystemPrefixCache:
+    """KV cache of the tokenized system-prompt prefix, computed once per model load.
+
+    Every request starts with the same ``<|im_start|>system ... <|im_start|>user\\n``
+    tokens, so their keys/values are prefilled once and copied into each generate call.
+    Only the suffix (image, user prompt, assistant header) is prefilled per request.
+
+    Qwen2-VL's ``prepare_inputs_for_generation`` drops ``pixel_values`` once the cache
+    is non-empty, so the suffix is prefilled here with the image embeddings scattered in
+    and multimodal (M-RoPE) positions from ``get_rope_index``; ``generate`` then only
+    runs the decode steps. Batches qualify when every row starts with the prefix and
+    carries no padding.
+    """
+
+    def __init__(self, model, tokenizer, prefix_text: str, device):
+        self.model = model
+        self.prefix_ids = tokenizer(prefix_text, return_tensors="pt").input_ids[0].to(device)
+        self._lock = threading.Lock()
+        self._kv: Optional[DynamicCache] = None
+        self.hits = 0
+        self.misses = 0
+
+    @torch.inference_mode()
+    def _prefix_kv(self) -> DynamicCache:
+        with self._lock:
+            if self._kv is None:
+                kv = DynamicCache()
+                self.model(input_ids=self.prefix_ids.unsqueeze(0), past_key_values=kv, use_cache=True)
+                self._kv = kv
+            return self._kv
+
+    def _batched_copy(self, batch_size: int) -> DynamicCache:
+        cache = copy.deepcopy(self._prefix_kv())
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        return cache
+
+    def applies_to(self, inputs: dict) -> bool:
+        input_ids = inputs["input_ids"]
+        p = self.prefix_ids.shape[0]
+        if input_ids.shape[1] <= p + 1 or "pixel_values" not in inputs:
+            return False
+        mask = inputs.get("attention_mask")
+        if mask is not None and not bool(mask.all()):
+            return False
+        return bool((input_ids[:, :p] == self.prefix_ids).all())
+
+    @torch.inference_mode()
+    def generate(self, inputs: dict, **generate_kwargs) -> Optional[torch.Tensor]:
+        """Generate reusing the prefix KV cache, or return None if the inputs don't qualify"""
+        if not self.applies_to(inputs):
+            self.misses += 1
+            return None
+
+        model = self.model
+        input_ids = inputs["input_ids"]
+        image_grid_thw = inputs["image_grid_thw"]
+        batch_size, length = input_ids.shape
+        p = self.prefix_ids.shape[0]
+        attention_mask = torch.ones_like(input_ids)
+
+        # Multimodal positions for the full sequence; prefix positions match the cached ones
+        position_ids, rope_deltas = model.get_rope_index(input_ids, image_grid_thw, None, attention_mask)
+
+        # Suffix embeddings with the image features scattered into the image placeholders
+        suffix_ids = input_ids[:, p:]
+        embeds = model.get_input_embeddings()(suffix_ids)
+        pixel_values = inputs["pixel_values"].type(model.visual.get_dtype())
+        image_embeds = model.visual(pixel_values, grid_thw=image_grid_thw)
+        image_mask = (suffix_ids == model.config.image_token_id).unsqueeze(-1).expand_as(embeds)
+        embeds = embeds.masked_scatter(image_mask, image_embeds.to(embeds.device, embeds.dtype))
+
+        # Prefill all but the last suffix token; generate() feeds that one itself
+        cache = self._batched_copy(batch_size)
+        model(
+            inputs_embeds=embeds[:, :-1],
+            attention_mask=attention_mask[:, :-1],
+            position_ids=position_ids[:, :, p:length - 1],
+            past_key_values=cache,
+            use_cache=True
+        )
+
+        self.hits += 1
+        return model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            rope_deltas=rope_deltas,
+            **generate_kwargs
+        )
+
+    def stats(self) -> dict:
+        return {"prefix_tokens": int(self.prefix_ids.shape[0]), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,161 @@
+import asyncio
+import time
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from settings import settings
+
+
+async def get_within(queue: asyncio.Queue, timeout: float):
+    """``queue.get()`` that raises asyncio.TimeoutError after ``timeout`` seconds.
+
+    Stands in for ``asyncio.wait_for(queue.get(), timeout)``, which on Python 3.11 can
+    swallow a cancellation that arrives as the item does, leaving a cancelled task running.
+    """
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        done, _ = await asyncio.wait({getter}, timeout=timeout)
+    finally:
+        if not getter.done():
+            getter.cancel()  # Queue.get leaves the item queued when cancelled
+    if getter in done:
+        return getter.result()
+    raise asyncio.TimeoutError()
+
+
+class InferenceScheduler:
+    """Dynamic micro-batcher that merges concurrent requests into one batched generate.
+
+    Callers await ``predict`` with an already preprocessed image. The scheduler waits
+    at most ``max_wait_ms`` after the first queued request for others to arrive, runs
+    up to ``max_batch_size`` of them as one GPU batch on a dedicated thread (so the
+    event loop is never blocked) and resolves each caller with its own result.
+    """
+
+    def __init__(self, vlm, max_batch_size: Optional[int] = None, max_wait_ms: Optional[int] = None):
+        self.vlm = vlm
+        self.max_batch_size = max_batch_size or settings.scheduler_max_batch_size
+        self.max_wait_ms = settings.scheduler_max_wait_ms if max_wait_ms is None else max_wait_ms
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        # Batching statistics
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def start(self):
+        """Start the batching loop on the running event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and release the inference thread"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def predict(self, image: Image.Image, prompt: str, image_hash: Optional[str] = None) -> str:
+        """Queue one image for the next batch and wait for its suggested name"""
+        if self._task is None:
+            self.start()
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((image, prompt, image_hash, future))
+        return await future
+
+    async def predict_many(self, images: List[Image.Image], prompts: List[str],
+                           image_hashes: Optional[List[Optional[str]]] = None) -> list:
+        """Queue images together (so they land in the same batch where possible) and
+        return each one's suggested name, or the exception that failed it"""
+        if self._task is None:
+            self.start()
+        loop = asyncio.get_event_loop()
+        futures = []
+        for image, prompt, image_hash in zip(images, prompts, image_hashes or [None] * len(images)):
+            future = loop.create_future()
+            self._queue.put_nowait((image, prompt, image_hash, future))
+            futures.append(future)
+        # Not gather(return_exceptions=True): it would hand our own cancellation back as
+        # results and the caller would carry on instead of stopping
+        try:
+            await asyncio.wait(futures)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()  # The batcher drops requests whose futures are done
+            raise
+        return [future.exception() or future.result() for future in futures]
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+
+            # Collect concurrent requests until the batch is full or the window closes
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await get_within(self._queue, timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Drop requests whose callers have gone away
+            batch = [entry for entry in batch if not entry[3].done()]
+            if batch:
+                await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[tuple]):
+        loop = asyncio.get_event_loop()
+        images = [image for image, _, _, _ in batch]
+        prompts = [prompt for _, prompt, _, _ in batch]
+        image_hashes = [image_hash for _, _, image_hash, _ in batch]
+
+        try:
+            results = await loop.run_in_executor(self._executor, self.vlm.predict_batch, images, prompts, image_hashes)
+            self._resolve(batch, results)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                self._resolve(batch, [e])
+                return
+            print(f"⚠️ Scheduler batch of {len(batch)} failed ({e}), retrying requests individually")
+
+        # Isolate failures so one bad request does not fail the others
+        for entry in batch:
+            image, prompt, image_hash, _ = entry
+            try:
+                result = (await loop.run_in_executor(
+                    self._executor, self.vlm.predict_batch, [image], [prompt], [image_hash]
+                ))[0]
+            except Exception as e:
+                result = e
+            self._resolve([entry], [result])
+
+    def _resolve(self, batch: List[tuple], results: list):
+        self.batches_run += 1
+        self.requests_served += len(batch)
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Batching statistics for monitoring"""
+        return {
+            "batches_run": self.batches_run,
+            "requests_served": self.requests_served,
+            "avg_batch_size": (self.requests_served / self.batches_run) if self.batches_run else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms
+        }
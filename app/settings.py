@@ -1,5 +1,8 @@
 from pydantic_settings import BaseSettings
 
+# Model tiers served by inference.TIERS, listed here so the API can validate them without torch
+TIER_NAMES = ("quality", "fast")
+
 
 class Settings(BaseSettings):
     aws_region: str = "us-east-1"
@@ -7,22 +10,86 @@ class Settings(BaseSettings):
     s3_out_bucket: str
     sqs_queue_url: str
     model_id: str = "Qwen/Qwen2-VL-2B-Instruct"
+    default_tier: str = "quality"  # "quality" (model_id VLM) or "fast" (fast_model_id captioner)
+    fast_model_id: str = "Salesforce/blip-image-captioning-base"  # Small captioner for the fast tier
+    fast_max_new_tokens: int = 20  # Caption length cap for the fast tier
+    model_artifact_dir: str = ""  # Pre-quantized checkpoint from materialize.py ("" = load model_id)
+    startup_warmup: bool = True  # Run dummy batches before reporting the model ready
+    warmup_batch_sizes: str = ""  # Comma-separated warmup batch sizes ("" = preview and job sizes in use)
     max_pixels: int = 786432  # ~0.75MP
     max_new_tokens: int = 50
+    constrained_decoding: bool = False  # Only allow [a-z0-9-] filename tokens, stop when complete
+    prefix_cache_enabled: bool = True  # Reuse the system-prompt KV cache across requests
+    speculative_decoding: bool = False  # Draft tokens from recent filenames, verify in one pass (batch size 1)
+    speculative_num_tokens: int = 8  # Max drafted tokens per verification step
+    speculative_max_ngram: int = 3  # Longest n-gram matched against recent outputs
+    speculative_history: int = 256  # Recent filenames kept for drafting
     batch_size: int = 16  # Optimized for 8-bit quantization
     api_port: int = 80
     
+    # Inference service: the worker hosts the model and serves previews to the API
+    inference_service_url: str = ""  # e.g. "http://worker:8001" ("" = the API loads its own model)
+    inference_service_port: int = 8001  # Port the worker serves previews on (0 = disabled)
+    inference_service_timeout_seconds: float = 60.0  # Per-preview request timeout from the API
+    
     # Security
     api_key: str = "sk-demo-key"
     
     # Cost-optimized quantization settings (50% cost reduction, 20% speed boost)
-    quantization: str = "8bit"  # Faster than 4-bit, better quality
+    quantization: str = "8bit"  # Faster than 4-bit, better quality ("int8" = dynamic int8 on CPU workers)
     use_flash_attention: bool = False  # Disabled for compatibility
     
     # Performance optimizations
     max_batch_size: int = 24  # Larger batches for efficiency
+    cpu_max_batch_size: int = 4  # Batch cap on CPU workers, where bigger batches only add latency
+    cpu_threads: int = 0  # Intra-op threads on CPU workers (0 = all cores available to the process)
+    autotune_profile_path: str = "./autotune_profile.json"  # Measured batch memory profiles
+    autotune_on_startup: bool = False  # Calibrate at model load if no profile exists
+    autotune_memory_fraction: float = 0.85  # Share of free memory batches may use
+    autotune_ceiling_probe_batches: int = 50  # Successful batches at the OOM ceiling before trying one larger
+    batch_token_budget: int = 0  # Max padded visual tokens per batch (0 = batch size only)
+    bucket_window_batches: int = 4  # Batches' worth of queued images sorted together into buckets
     parallel_downloads: int = 8  # Parallel S3 operations
+    decode_mode: str = "thread"  # "thread" or "process" (process pool + shared memory)
+    decode_processes: int = 0  # Decode processes in "process" mode (0 = CPU count)
     auto_scale_hours: int = 16  # Instance active 16 hours/day
+    
+    # Worker job intake
+    worker_concurrent_jobs: int = 4  # SQS messages prefetched and processed at once
+    sqs_visibility_timeout_seconds: int = 300  # Visibility granted per receive and per heartbeat
+    sqs_heartbeat_seconds: int = 60  # How often running jobs extend their message visibility
+    job_shard_size: int = 500  # Files per SQS message; bigger jobs are split across workers (0 = never split)
+    manifest_part_size: int = 100  # Results per manifest part written while a job runs
+    inline_results_max: int = 100  # Jobs with at most this many results include them in job_complete
+    results_page_size: int = 1000  # Default results page size (offset/limit paging)
+    results_max_page_size: int = 10000  # Largest page a single request may ask for
+    results_part_gap_seconds: int = 60  # Partial results skip a missing part number once the part after it is this old
+    job_checkpoint_enabled: bool = True  # Checkpoint finished items in Redis so redelivered jobs resume
+    item_max_attempts: int = 3  # Tries per item (across redeliveries) before its error is final
+    job_state_ttl_seconds: int = 86400  # Lifetime of a job's checkpoints and fan-in state in Redis
+    
+    # Worker pipeline stages (S3 fetch -> decode -> GPU -> write)
+    fetch_workers: int = 8  # Concurrent S3 downloads per job
+    decode_workers: int = 4  # Concurrent decode/resize tasks per job
+    pipeline_queue_size: int = 32  # Max items buffered between stages
+    batch_wait_ms: int = 50  # Max wait to fill a GPU batch
+    
+    # Preview micro-batching across concurrent requests
+    scheduler_max_batch_size: int = 8  # Max previews merged into one generate
+    scheduler_max_wait_ms: int = 10  # Max wait for concurrent previews to arrive
+    
+    # Result cache: (image hash, prompt, model config) -> suggested name
+    result_cache_backend: str = "memory"  # "memory", "redis" or "none"
+    result_cache_max_entries: int = 10000
+    result_cache_ttl_seconds: int = 604800  # 7 days
+    redis_url: str = "redis://localhost:6379/0"
+    
+    # Decoded-image cache, sized to worker RAM
+    image_cache_max_bytes: int = 268435456  # 256MB of decoded RGB pixels
+    
+    # Vision-embedding cache: re-prompting an image skips the vision encoder
+    vision_cache_enabled: bool = False
+    vision_cache_max_bytes: int = 536870912  # 512MB of cached embeddings
 
     class Config:
         env_file = ".env"
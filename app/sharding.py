@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional
+from settings import settings
+from cache import connect_redis
+
+# A job larger than settings.job_shard_size is enqueued as several shard messages. Each
+# shard appends its results to the job's manifest parts and reports in; the worker that
+# completes the last shard assembles the manifest (global name deduplication) and sends
+# job_complete.
+
+
+def shard_prefix(job_id: str) -> str:
+    return f"demo/jobs/{job_id}/shards/"
+
+
+def split_job(job_message: Dict[str, Any], shard_size: int) -> List[Dict[str, Any]]:
+    """SQS messages for a job: itself when small, else one per ``shard_size`` files"""
+    file_keys = job_message["file_keys"]
+    if shard_size <= 0 or len(file_keys) <= shard_size:
+        return [job_message]
+    offsets = range(0, len(file_keys), shard_size)
+    return [
+        {
+            **job_message,
+            "file_keys": file_keys[offset:offset + shard_size],
+            "shard": {"index": index, "count": len(offsets), "offset": offset}
+        }
+        for index, offset in enumerate(offsets)
+    ]
+
+
+class ShardTracker:
+    """Fan-in bookkeeping for sharded jobs.
+
+    Finished shard indices go into a Redis set, so a redelivered shard is not counted
+    twice. Without Redis each shard writes an empty marker object to S3 and the markers
+    are counted instead. Any call that finds every shard done completes the job, so a
+    redelivered last shard can still assemble a manifest whose first attempt crashed or
+    failed; two workers finishing at the same moment may then both assemble it (assembly
+    is idempotent; job_complete may be sent twice).
+    """
+
+    def __init__(self, s3):
+        self.s3 = s3
+        self.client = connect_redis("shard tracking, counting shard markers in S3")
+
+    def mark_done(self, job_id: str, shard_index: int, shard_count: int) -> bool:
+        """Record a finished shard; True once every shard of the job is done"""
+        if self.client is not None:
+            try:
+                key = f"job_shards:{job_id}"
+                pipe = self.client.pipeline()
+                pipe.sadd(key, shard_index)
+                pipe.scard(key)
+                pipe.expire(key, settings.job_state_ttl_seconds)
+                _, done, _ = pipe.execute()
+                return done == shard_count
+            except Exception as e:
+                print(f"⚠️ Redis shard tracking failed ({e}), counting shard markers in S3")
+        self.s3.put_object(
+            Bucket=settings.s3_out_bucket, Key=f"{shard_prefix(job_id)}{shard_index:05d}.done", Body=b""
+        )
+        return len(self._list_shards(job_id)) == shard_count
+
+    def cleanup(self, job_id: str):
+        """Drop the fan-in state once the manifest is written"""
+        keys = self._list_shards(job_id)
+        for start in range(0, len(keys), 1000):
+            self.s3.delete_objects(
+                Bucket=settings.s3_out_bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]]}
+            )
+        if self.client is not None:
+            try:
+                self.client.delete(f"job_shards:{job_id}")
+            except Exception:
+                pass
+
+    def _list_shards(self, job_id: str) -> List[str]:
+        keys: List[str] = []
+        token: Optional[str] = None
+        while True:
+            kwargs = {"Bucket": settings.s3_out_bucket, "Prefix": shard_prefix(job_id)}
+            if token:
+                kwargs["ContinuationToken"] = token
+            page = self.s3.list_objects_v2(**kwargs)
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+            if not page.get("IsTruncated"):
+                return keys
+            token = page.get("NextContinuationToken")
@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+import torch
+from transformers.generation.candidate_generator import PromptLookupCandidateGenerator
+
+
+class RecentOutputLookup:
+    """N-gram drafting from recently generated filenames (prompt-lookup decoding).
+
+    Filenames reuse a small vocabulary ("golden-retriever", "sunset", ...), so the
+    continuation of the current n-gram in a recent output is a good guess for the next
+    few tokens. Each stored sequence starts with the tail of its prompt (the assistant
+    header), so even the first filename tokens can be drafted. Drafts are verified by the
+    model in one forward pass and only the tokens greedy decoding would have produced are
+    kept, so output is unchanged.
+    """
+
+    def __init__(self, history_size: int, num_tokens: int, max_ngram: int):
+        self.num_tokens = num_tokens
+        self.max_ngram = max_ngram
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.drafted = 0
+        self.accepted = 0
+
+    def observe(self, context_ids: List[int], output_ids: List[int]):
+        """Remember a finished generation (prompt tail + generated tokens)"""
+        if output_ids:
+            with self._lock:
+                self._history.appendleft(tuple(context_ids[-self.max_ngram:]) + tuple(output_ids))
+
+    def draft(self, sequence: List[int]) -> List[int]:
+        """Tokens that followed the longest matching n-gram in a recent output"""
+        with self._lock:
+            history = list(self._history)
+        for n in range(min(self.max_ngram, len(sequence)), 0, -1):
+            ngram = tuple(sequence[-n:])
+            for past in history:
+                for start in range(len(past) - n):
+                    if past[start:start + n] == ngram:
+                        return list(past[start + n:start + n + self.num_tokens])
+        return []
+
+    def record(self, drafted: int, accepted: int):
+        with self._lock:
+            self.calls += 1
+            self.drafted += drafted
+            self.accepted += accepted
+
+    def candidate_generator(self, generation_config) -> "HistoryCandidateGenerator":
+        return HistoryCandidateGenerator(
+            self,
+            eos_token_id=generation_config._eos_token_tensor,
+            num_output_tokens=self.num_tokens,
+            max_matching_ngram_size=self.max_ngram,
+            max_length=generation_config.max_length
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "history": len(self._history),
+                "verify_steps": self.calls,
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": (self.accepted / self.drafted) if self.drafted else None
+            }
+
+
+class HistoryCandidateGenerator(PromptLookupCandidateGenerator):
+    """Prompt-lookup candidates drawn from recent outputs first, then from the sequence itself"""
+
+    def __init__(self, lookup: RecentOutputLookup, **kwargs):
+        super().__init__(**kwargs)
+        self.lookup = lookup
+        self._last_drafted = 0
+
+    def get_candidates(self, input_ids: torch.LongTensor) -> Tuple[torch.LongTensor, Optional[torch.FloatTensor]]:
+        input_length = input_ids.shape[1]
+        room = self.max_length - input_length - 1
+        draft = self.lookup.draft(input_ids[0].tolist())[:max(0, room)]
+
+        # Stop the draft at EOS so generation still ends where greedy decoding would
+        eos = set(self.eos_token_id.view(-1).tolist()) if self.eos_token_id is not None else set()
+        for i, token in enumerate(draft):
+            if token in eos:
+                draft = draft[:i]
+                break
+
+        if draft:
+            candidate_ids = torch.cat([input_ids, input_ids.new_tensor([draft])], dim=1)
+        else:
+            candidate_ids, _ = super().get_candidates(input_ids)
+            # The parent lookup does not bound drafts by the remaining length
+            candidate_ids = candidate_ids[:, :input_length + max(0, room)]
+        self._last_drafted = candidate_ids.shape[1] - input_length
+        return candidate_ids, None
+
+    def update_candidate_strategy(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, num_matches: int):
+        self.lookup.record(self._last_drafted, int(num_matches))
@@ -0,0 +1,84 @@
+import threading
+import hashlib
+from contextlib import contextmanager
+from typing import List, Optional
+import torch
+from settings import settings
+from cache import MemoryLRUBackend
+
+
+def _tensor_nbytes(t: torch.Tensor) -> int:
+    return t.numel() * t.element_size()
+
+
+class CachedVisionTower(torch.nn.Module):
+    """Wraps Qwen2-VL's vision encoder with a per-image embedding cache.
+
+    The model calls ``visual(pixel_values, grid_thw=...)`` with the patches of every
+    image in the batch concatenated. When the caller has announced one cache key per
+    image (see ``image_keys``), cached embeddings are reused and the encoder only runs
+    on the misses, so re-prompting an image repeats just the language-model decode.
+    """
+
+    def __init__(self, visual: torch.nn.Module, max_bytes: int):
+        super().__init__()
+        self.visual = visual
+        self.cache = MemoryLRUBackend(max_bytes=max_bytes, sizeof=_tensor_nbytes)
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        # Delegate attributes like get_dtype() and spatial_merge_size to the wrapped encoder
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules["visual"], name)
+
+    @staticmethod
+    def make_key(image_hash: str, image_size: tuple) -> str:
+        """Cache key from the original image hash and the preprocessing that shaped its patches"""
+        parts = [image_hash, settings.model_id, str(settings.max_pixels), f"{image_size[0]}x{image_size[1]}"]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def image_keys(self, keys: List[Optional[str]]):
+        """Announce per-image cache keys for the next forward passes on this thread"""
+        self._local.keys = keys
+        try:
+            yield
+        finally:
+            self._local.keys = None
+
+    def forward(self, pixel_values: torch.Tensor, grid_thw: torch.Tensor = None, **kwargs):
+        keys = getattr(self._local, "keys", None)
+        if not keys or grid_thw is None or len(keys) != grid_thw.shape[0]:
+            return self.visual(pixel_values, grid_thw=grid_thw, **kwargs)
+
+        # Patch rows per image in pixel_values, and embedding rows after spatial merging
+        patch_counts = grid_thw.prod(-1).tolist()
+        merge = getattr(self.visual, "spatial_merge_size", 2)
+        embed_counts = [n // (merge * merge) for n in patch_counts]
+
+        embeds = [self.cache.get(key) if key else None for key in keys]
+        misses = [i for i, e in enumerate(embeds) if e is None]
+
+        if misses:
+            patches = torch.split(pixel_values, patch_counts, dim=0)
+            miss_embeds = self.visual(
+                torch.cat([patches[i] for i in misses], dim=0),
+                grid_thw=grid_thw[misses],
+                **kwargs
+            )
+            for i, e in zip(misses, torch.split(miss_embeds, [embed_counts[i] for i in misses], dim=0)):
+                embeds[i] = e
+                if keys[i]:
+                    self.cache.set(keys[i], e.detach())
+
+        return torch.cat(embeds, dim=0)
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats.as_dict(),
+            "entries": len(self.cache),
+            "bytes": self.cache.current_bytes,
+            "max_bytes": self.cache.max_bytes
+        }
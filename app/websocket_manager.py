@@ -1,17 +1,21 @@
 import json
 import asyncio
-from typing import Dict, Set
+from typing import Dict, Optional, Set
 from fastapi import WebSocket
-import redis
 from datetime import datetime
+from cache import async_redis
+
+# Every process publishes job updates here; every API replica subscribes and forwards
+# them to its own WebSocket connections
+UPDATES_CHANNEL = "renamer:job_updates"
 
 class WebSocketManager:
     def __init__(self):
         self.active_connections: Dict[str, Set[WebSocket]] = {}
-        try:
-            self.redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-        except:
-            self.redis_client = None
+        # Set while this process is subscribed to UPDATES_CHANNEL (API replicas)
+        self.listening = False
+        self._listener: Optional[asyncio.Task] = None
+        self._redis_warned = False
 
     async def connect(self, websocket: WebSocket, job_id: str):
         await websocket.accept()
@@ -26,39 +30,88 @@ class WebSocketManager:
                 del self.active_connections[job_id]
 
     async def send_update(self, job_id: str, message: dict):
-        """Send update to all WebSocket connections for a job"""
+        """Store an update in the job's history and publish it to every API replica"""
         message["timestamp"] = datetime.now().isoformat()
-        
-        # Store in Redis for persistence (if available)
-        if self.redis_client:
+        payload = json.dumps(message)
+
+        # Store in Redis for persistence and fan out, in one round trip
+        published = False
+        try:
+            pipe = async_redis().pipeline(transaction=False)
+            pipe.lpush(f"job_updates:{job_id}", payload)
+            pipe.expire(f"job_updates:{job_id}", 3600)  # 1 hour TTL
+            pipe.publish(UPDATES_CHANNEL, json.dumps({"job_id": job_id, "message": payload}))
+            await pipe.execute()
+            published = True
+            self._redis_warned = False
+        except Exception as e:
+            if not self._redis_warned:
+                print(f"⚠️ Redis unavailable for job updates ({e}), delivering to local connections only")
+                self._redis_warned = True
+
+        # Our own subscription delivers published updates; otherwise send directly
+        if not (published and self.listening):
+            await self.deliver(job_id, payload)
+
+    async def deliver(self, job_id: str, payload: str):
+        """Send an update to this process's WebSocket connections for a job"""
+        websockets = list(self.active_connections.get(job_id, ()))
+        if not websockets:
+            return
+        results = await asyncio.gather(*(ws.send_text(payload) for ws in websockets), return_exceptions=True)
+
+        # Remove disconnected websockets
+        for ws, result in zip(websockets, results):
+            if isinstance(result, Exception):
+                self.disconnect(ws, job_id)
+
+    def start_listener(self):
+        """Forward updates published by any process (workers, other replicas) to local connections"""
+        if self._listener is None:
+            self._listener = asyncio.get_event_loop().create_task(self._listen())
+
+    async def stop_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
             try:
-                self.redis_client.lpush(f"job_updates:{job_id}", json.dumps(message))
-                self.redis_client.expire(f"job_updates:{job_id}", 3600)  # 1 hour TTL
-            except:
+                await self._listener
+            except asyncio.CancelledError:
                 pass
-        
-        # Send to active WebSocket connections
-        if job_id in self.active_connections:
-            disconnected = []
-            for websocket in self.active_connections[job_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except:
-                    disconnected.append(websocket)
-            
-            # Remove disconnected websockets
-            for ws in disconnected:
-                self.active_connections[job_id].discard(ws)
+            self._listener = None
+        self.listening = False
+
+    async def _listen(self):
+        while True:
+            pubsub = async_redis().pubsub()
+            try:
+                await pubsub.subscribe(UPDATES_CHANNEL)
+                self.listening = True
+                print(f"📡 Subscribed to {UPDATES_CHANNEL}")
+                while True:
+                    # Short polls: a blocking read would hit the shared client's socket_timeout
+                    # whenever no job is publishing and drop the subscription
+                    item = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if item is None or item.get("type") != "message":
+                        continue
+                    update = json.loads(item["data"])
+                    if update["job_id"] in self.active_connections:
+                        await self.deliver(update["job_id"], update["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.listening = False
+                print(f"⚠️ Job update subscription lost ({e}), retrying in 5s")
+                await asyncio.sleep(5)
+            finally:
+                self.listening = False
+                await pubsub.aclose()
 
     async def get_job_history(self, job_id: str, limit: int = 50):
         """Get recent updates for a job (for clients that missed real-time updates)"""
-        if not self.redis_client:
-            return []
-        
         try:
-            updates = self.redis_client.lrange(f"job_updates:{job_id}", 0, limit - 1)
+            updates = await async_redis().lrange(f"job_updates:{job_id}", 0, limit - 1)
             return [json.loads(update) for update in reversed(updates)]
-        except:
+        except Exception:
             return []
 
 # Global WebSocket manager instance
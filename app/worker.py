@@ -1,272 +1,296 @@
 import json
 import boto3
-import time
 import asyncio
-from typing import Dict, Any, List
+from typing import Dict, Any
 from concurrent.futures import ThreadPoolExecutor
 from settings import settings
-from inference import get_vlm
-from naming import dedupe
+from scheduler import InferenceScheduler
+from pipeline import JobPipeline
+from sharding import ShardTracker
+from manifest import PartSequence, assemble_manifest, delete_parts, manifest_key
+from checkpoint import JobCheckpoint
 from websocket_manager import send_job_update
-from datetime import datetime
+from job_state import job_status
 
-# AWS clients with optimized configuration
+# Decode-pool processes (settings.decode_mode = "process") re-import this module as
+# __mp_main__, so importing it stays light: torch and the model stack are imported in
+# the functions that need them, and AWS/Redis clients are created by init_clients()
 from botocore.config import Config
 
 config = Config(
     retries={'max_attempts': 3},
     max_pool_connections=50
 )
-sqs = boto3.client("sqs", region_name=settings.aws_region, config=config)
-s3 = boto3.client("s3", region_name=settings.aws_region, config=config)
+sqs = None
+s3 = None
 
 # Global VLM instance - load once at startup
 vlm = None
 
+# S3 downloads run in parallel; model calls go through one shared scheduler per tier
+download_executor = ThreadPoolExecutor(max_workers=settings.fetch_workers)
+job_schedulers: Dict[str, InferenceScheduler] = {}
+
+# Fan-in of sharded jobs (see sharding.py), per-item progress for resuming redelivered jobs
+# and the job-wide order of manifest parts
+shard_tracker = None
+job_checkpoint = None
+part_sequence = None
+
+def init_clients():
+    """AWS clients with optimized configuration, and the Redis-backed job state helpers"""
+    global sqs, s3, shard_tracker, job_checkpoint, part_sequence
+    sqs = boto3.client("sqs", region_name=settings.aws_region, config=config)
+    s3 = boto3.client("s3", region_name=settings.aws_region, config=config)
+    shard_tracker = ShardTracker(s3)
+    job_checkpoint = JobCheckpoint()
+    part_sequence = PartSequence()
+
 def init_vlm():
     """Initialize VLM model once at startup"""
     global vlm
+    from inference import get_vlm
     if vlm is None:
         print("🤖 Loading VLM model...")
         vlm = get_vlm()
         print("✅ VLM model loaded successfully")
 
-async def process_single_file(file_key: str, index: int, user_prompt: str, job_id: str, existing_names: set) -> Dict[str, Any]:
-    """Process a single file with error handling"""
-    try:
-        # Send processing update
-        await send_job_update(job_id, "item_processing", {
-            "index": index,
-            "filename": file_key.split('/')[-1],
-            "status": "downloading"
-        })
-        
-        # Download image from S3
-        print(f"📥 Processing file {index+1}: {file_key}")
-        response = s3.get_object(Bucket=settings.s3_in_bucket, Key=file_key)
-        
-        # Stream the file content instead of loading all into memory
-        image_bytes = response['Body'].read()
-        
-        # Send AI processing update
-        await send_job_update(job_id, "item_processing", {
-            "index": index,
-            "filename": file_key.split('/')[-1],
-            "status": "ai_processing"
-        })
-        
-        # Generate filename using AI
-        start_time = time.time()
-        suggested_name = vlm.predict_single(image_bytes, user_prompt)
-        processing_time = time.time() - start_time
-        
-        # Handle deduplication (thread-safe)
-        final_name = dedupe(suggested_name, existing_names)
-        
-        # Determine file extension from original
-        original_filename = file_key.split('/')[-1]
-        original_ext = original_filename.split('.')[-1] if '.' in original_filename else 'jpg'
-        final_filename = f"{final_name}.{original_ext}"
-        
-        # Create result
-        result = {
-            "index": index,
-            "original": original_filename,
-            "suggested": final_filename,
-            "processing_time_ms": int(processing_time * 1000),
-            "status": "completed",
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        print(f"✅ Completed {index+1}: {original_filename} → {final_filename}")
-        return result
-        
-    except Exception as e:
-        error_msg = str(e)
-        print(f"❌ Error processing file {index+1}: {error_msg}")
-        
-        return {
-            "index": index,
-            "original": file_key.split('/')[-1],
-            "suggested": None,
-            "error": error_msg,
-            "status": "error",
-            "timestamp": datetime.now().isoformat()
-        }
+def get_job_scheduler(tier: str, backend) -> InferenceScheduler:
+    """Micro-batcher shared by all concurrent jobs of a tier, capped at the job batch size"""
+    scheduler = job_schedulers.get(tier)
+    if scheduler is None:
+        scheduler = InferenceScheduler(backend, max_batch_size=backend._get_dynamic_batch_size(settings.max_batch_size))
+        scheduler.start()
+        job_schedulers[tier] = scheduler
+    return scheduler
+
+async def send_pipeline_update(job_id: str, update_type: str, data: Dict[str, Any]):
+    """send_job_update that also counts finished items in the job's status record, and
+    reports that job-wide count (across shards) as progress when Redis has it"""
+    if update_type == "item_complete":
+        finished = await job_status.item_finished(job_id, data["result"])
+        if finished is not None:
+            progress = data["progress"]
+            progress["completed"] = min(finished, progress["total"])
+    await send_job_update(job_id, update_type, data)
+
+async def fail_job(job_id: str, error: str):
+    await job_status.finish(job_id, "failed", error=error)
+    await send_job_update(job_id, "job_error", {"error": error})
 
 async def process_job_with_progress(job_data: Dict[str, Any]):
-    """Process job with parallel file processing and real-time progress updates"""
+    """Process job through the staged streaming pipeline with real-time progress updates"""
     job_id = job_data["job_id"]
     file_keys = job_data["file_keys"]
     user_prompt = job_data.get("user_prompt", "")
-    total_files = len(file_keys)
+    tier = job_data.get("tier") or settings.default_tier
+    total_files = job_data.get("total_files") or len(file_keys)
+    
+    # Other tiers load lazily on their first job, off the event loop other jobs are using
+    from inference import get_vlm
+    loop = asyncio.get_event_loop()
+    try:
+        backend = await loop.run_in_executor(None, get_vlm, tier)
+    except Exception as e:
+        print(f"❌ Failed to load {tier} tier for job {job_id}: {e}")
+        await fail_job(job_id, f"Model tier unavailable: {str(e)}")
+        return
     
-    # Configure concurrency based on file count and system resources
-    max_concurrent = min(5, max(1, total_files // 2))  # Dynamic concurrency
+    shard = job_data.get("shard")
+    pipeline = JobPipeline(
+        job_id, file_keys, user_prompt, backend, s3, send_pipeline_update,
+        download_executor, get_job_scheduler(tier, backend),
+        index_offset=shard["offset"] if shard else 0, dedupe_names=shard is None,
+        checkpoint=job_checkpoint, total_items=total_files, part_sequence=part_sequence
+    )
+    # Batch size scales with settings.max_batch_size (bounded by available GPU memory)
+    batch_size = pipeline.batch_size
     
-    print(f"🔄 Starting job {job_id} with {total_files} files (max concurrent: {max_concurrent})")
+    if shard:
+        print(f"🔄 Starting job {job_id} shard {shard['index'] + 1}/{shard['count']} with {len(file_keys)} files "
+              f"({tier} tier, batch size: {batch_size})")
+        await send_job_update(job_id, "shard_started", {
+            "shard": shard,
+            "files": len(file_keys),
+            "total_files": total_files,
+            "tier": tier,
+            "batch_size": batch_size
+        })
+        await job_status.start(job_id)
+        # Shard failures propagate so SQS redelivers the shard; the job cannot complete without it
+        await pipeline.run()
+        await process_shard_results(job_data, backend, batch_size)
+        return
+    
+    print(f"🔄 Starting job {job_id} with {total_files} files ({tier} tier, batch size: {batch_size})")
     
     # Send job started update
+    await job_status.start(job_id)
     await send_job_update(job_id, "job_started", {
         "total_files": total_files,
         "completed": 0,
         "status": "processing",
-        "max_concurrent": max_concurrent
+        "tier": tier,
+        "batch_size": batch_size
     })
     
-    # Ensure VLM is loaded
-    if vlm is None:
-        init_vlm()
-    
-    # Track processed names for deduplication (thread-safe set)
-    existing_names = set()
-    results = []
-    completed_count = 0
-    
-    # Create semaphore to limit concurrent processing
-    semaphore = asyncio.Semaphore(max_concurrent)
-    
-    async def process_with_semaphore(file_key: str, index: int) -> Dict[str, Any]:
-        """Process file with concurrency control"""
-        nonlocal completed_count
-        
-        async with semaphore:
-            result = await asyncio.get_event_loop().run_in_executor(
-                None,  # Use default thread pool
-                lambda: asyncio.run(process_single_file(file_key, index, user_prompt, job_id, existing_names))
-            )
-            
-            # Update progress atomically
-            completed_count += 1
-            
-            # Send individual completion update
-            await send_job_update(job_id, "item_complete", {
-                "result": result,
-                "progress": {"completed": completed_count, "total": total_files}
-            })
-            
-            return result
-    
-    # Create tasks for all files
-    tasks = [
-        process_with_semaphore(file_key, index) 
-        for index, file_key in enumerate(file_keys)
-    ]
-    
-    # Process all files concurrently with progress tracking
     try:
-        print(f"🚀 Starting parallel processing of {total_files} files...")
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Handle any exceptions in results
-        processed_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                error_result = {
-                    "index": i,
-                    "original": file_keys[i].split('/')[-1],
-                    "suggested": None,
-                    "error": str(result),
-                    "status": "error",
-                    "timestamp": datetime.now().isoformat()
-                }
-                processed_results.append(error_result)
-            else:
-                processed_results.append(result)
-        
-        results = processed_results
+        # Stream files through fetch -> decode -> inference -> write stages (results land in manifest parts)
+        await pipeline.run()
         
     except Exception as e:
-        print(f"❌ Error in parallel processing: {e}")
+        print(f"❌ Error in job pipeline: {e}")
         # Send error update for the entire job
-        await send_job_update(job_id, "job_error", {
-            "error": f"Parallel processing failed: {str(e)}"
-        })
+        await fail_job(job_id, f"Pipeline processing failed: {str(e)}")
         return
     
-    # Upload results to S3
     try:
-        # Create manifest file
-        manifest_lines = [json.dumps(result) for result in results]
-        manifest_content = '\n'.join(manifest_lines)
-        
-        # Upload manifest
-        s3.put_object(
-            Bucket=settings.s3_out_bucket,
-            Key=f"demo/jobs/{job_id}/manifest.jsonl",
-            Body=manifest_content.encode('utf-8'),
-            ContentType='application/jsonl'
+        await complete_job(job_id, total_files, backend, {"tier": tier, "batch_size": batch_size})
+    except Exception as e:
+        await fail_job(job_id, f"Failed to upload results: {str(e)}")
+        return
+    await loop.run_in_executor(download_executor, job_checkpoint.clear, job_id)
+
+async def process_shard_results(job_data: Dict[str, Any], backend, batch_size: int):
+    """Report a finished shard; the worker finishing the last shard completes the job"""
+    job_id = job_data["job_id"]
+    shard = job_data["shard"]
+    loop = asyncio.get_event_loop()
+    
+    all_done = await loop.run_in_executor(
+        download_executor, shard_tracker.mark_done, job_id, shard["index"], shard["count"]
+    )
+    print(f"📦 Job {job_id} shard {shard['index'] + 1}/{shard['count']} stored")
+    if not all_done:
+        return
+    
+    print(f"🧩 Merging {shard['count']} shards of job {job_id}")
+    tier = job_data.get("tier") or settings.default_tier
+    # A failed merge propagates, so SQS redelivers this shard and the merge is retried
+    await complete_job(job_id, job_data["total_files"], backend,
+                       {"tier": tier, "batch_size": batch_size, "shards": shard["count"]})
+    await loop.run_in_executor(download_executor, shard_tracker.cleanup, job_id)
+    await loop.run_in_executor(download_executor, job_checkpoint.clear, job_id)
+
+async def complete_job(job_id: str, total_files: int, backend, stats: Dict[str, Any]):
+    """Assemble the job manifest from its parts and send job_complete; raises if that failed"""
+    loop = asyncio.get_event_loop()
+    try:
+        # Stream the parts into manifest.jsonl (off the event loop, other jobs keep running)
+        summary = await loop.run_in_executor(
+            download_executor, assemble_manifest, s3, job_id, settings.inline_results_max
         )
         
-        # Send job completion update
-        successful_results = [r for r in results if r.get("status") == "completed"]
-        await send_job_update(job_id, "job_complete", {
+        # Send job completion update (small jobs inline their results)
+        update = {
             "total_files": total_files,
-            "completed": len(successful_results),
-            "errors": total_files - len(successful_results),
-            "results": results,
-            "manifest_url": f"s3://{settings.s3_out_bucket}/demo/jobs/{job_id}/manifest.jsonl",
+            "completed": summary["completed"],
+            "errors": total_files - summary["completed"],
+            "manifest_url": f"s3://{settings.s3_out_bucket}/{manifest_key(job_id)}",
             "processing_stats": {
-                "max_concurrent": max_concurrent,
-                "total_processing_time": sum(r.get("processing_time_ms", 0) for r in results if "processing_time_ms" in r)
+                **stats,
+                "throughput": backend.throughput.as_dict(),
+                "result_cache": backend.result_cache.stats() if backend.result_cache else None,
+                "autotune": backend.autotuner.report(),
+                "total_processing_time": summary["total_processing_time"]
             }
-        })
+        }
+        if "results" in summary:
+            update["results"] = summary["results"]
+        await job_status.finish(job_id, "completed", succeeded=summary["completed"],
+                                errors=total_files - summary["completed"])
+        await send_job_update(job_id, "job_complete", update)
         
-        print(f"🎉 Job {job_id} completed: {len(successful_results)}/{total_files} successful")
+        print(f"🎉 Job {job_id} completed: {summary['completed']}/{total_files} successful")
+        try:
+            await loop.run_in_executor(download_executor, delete_parts, s3, job_id)
+        except Exception as e:
+            print(f"⚠️ Could not delete manifest parts of job {job_id}: {e}")
         
     except Exception as e:
         print(f"❌ Error uploading results for job {job_id}: {e}")
-        await send_job_update(job_id, "job_error", {
-            "error": f"Failed to upload results: {str(e)}"
-        })
+        raise
+
+async def heartbeat(receipt_handle: str, job_id: str):
+    """Keep a running job's message invisible to other consumers until it is deleted"""
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(settings.sqs_heartbeat_seconds)
+        try:
+            await loop.run_in_executor(None, lambda: sqs.change_message_visibility(
+                QueueUrl=settings.sqs_queue_url,
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=settings.sqs_visibility_timeout_seconds
+            ))
+        except Exception as e:
+            print(f"⚠️ Visibility heartbeat failed for job {job_id}: {e}")
+
+async def handle_message(message: Dict[str, Any]):
+    """Process one SQS message and delete it on success; on failure it reappears for retry"""
+    receipt_handle = message['ReceiptHandle']
+    job_id = "unknown"
+    beat = None
+    try:
+        # Parse job data
+        job_data = json.loads(message['Body'])
+        job_id = job_data.get('job_id', 'unknown')
+        print(f"📨 Received job: {job_id}")
+        
+        beat = asyncio.create_task(heartbeat(receipt_handle, job_id))
+        await process_job_with_progress(job_data)
+        
+        # Delete message from queue on success
+        await asyncio.get_event_loop().run_in_executor(None, lambda: sqs.delete_message(
+            QueueUrl=settings.sqs_queue_url,
+            ReceiptHandle=receipt_handle
+        ))
+    except Exception as e:
+        print(f"❌ Error processing job {job_id}: {e}")
+        # Message will return to queue for retry
+    finally:
+        if beat is not None:
+            beat.cancel()
+
+async def consume():
+    """Prefetch up to worker_concurrent_jobs messages and run their jobs concurrently"""
+    loop = asyncio.get_event_loop()
+    active = set()
+    while True:
+        capacity = settings.worker_concurrent_jobs - len(active)
+        if capacity <= 0:
+            _, active = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            # Poll SQS for messages (long poll in a thread; running jobs keep going)
+            response = await loop.run_in_executor(None, lambda: sqs.receive_message(
+                QueueUrl=settings.sqs_queue_url,
+                MaxNumberOfMessages=min(capacity, 10),
+                WaitTimeSeconds=10 if not active else 1,
+                VisibilityTimeout=settings.sqs_visibility_timeout_seconds
+            ))
+        except Exception as e:
+            print(f"❌ Worker error: {e}")
+            await asyncio.sleep(5)
+            continue
+        
+        for message in response.get('Messages', []):
+            active.add(asyncio.create_task(handle_message(message)))
+        active = {task for task in active if not task.done()}
 
 def main():
     """Main worker loop"""
     print("🚀 Worker starting...")
+    init_clients()
     
-    # Initialize VLM model at startup
+    # Serve previews for the API from this process's model, then load it (shared singleton)
+    from inference_service import serve_in_background
+    serve_in_background()
     init_vlm()
     
-    while True:
-        try:
-            # Poll SQS for messages
-            response = sqs.receive_message(
-                QueueUrl=settings.sqs_queue_url,
-                MaxNumberOfMessages=1,
-                WaitTimeSeconds=10
-            )
-            
-            messages = response.get('Messages', [])
-            if not messages:
-                continue
-                
-            message = messages[0]
-            receipt_handle = message['ReceiptHandle']
-            
-            try:
-                # Parse job data
-                job_data = json.loads(message['Body'])
-                print(f"📨 Received job: {job_data.get('job_id', 'unknown')}")
-                
-                # Process job with parallel processing
-                asyncio.run(process_job_with_progress(job_data))
-                
-                # Delete message from queue on success
-                sqs.delete_message(
-                    QueueUrl=settings.sqs_queue_url,
-                    ReceiptHandle=receipt_handle
-                )
-                
-            except Exception as e:
-                print(f"❌ Error processing job: {e}")
-                # Message will return to queue for retry
-                
-        except KeyboardInterrupt:
-            print("🛑 Worker stopping...")
-            break
-        except Exception as e:
-            print(f"❌ Worker error: {e}")
-            time.sleep(5)
+    try:
+        asyncio.run(consume())
+    except KeyboardInterrupt:
+        print("🛑 Worker stopping...")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""CPU inference benchmark: float32 vs dynamic int8 (QUANTIZATION=int8).
+
+Usage:
+    python3 load_tests/bench_cpu.py [image_dir] [--count N] [--batch-size B] [--threads T]
+
+Loads the model once per mode on CPU, names the same images with each and reports
+latency per image, throughput, peak RSS and how many names match the float32 output.
+Without an image directory, synthetic photos are generated.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+# Settings requires these even though the benchmark never touches AWS
+for var in ("S3_IN_BUCKET", "S3_OUT_BUCKET", "SQS_QUEUE_URL"):
+    os.environ.setdefault(var, "bench")
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+from PIL import Image
+from settings import settings
+from autotune import _rss_bytes
+
+
+def synthetic_images(count: int) -> list:
+    images = []
+    for i in range(count):
+        im = Image.effect_noise((1600, 1200), 32 + i % 64).convert("RGB")
+        bio = io.BytesIO()
+        im.save(bio, "JPEG")
+        images.append(bio.getvalue())
+    return images
+
+
+def load_images(path: str) -> list:
+    images = []
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            with open(full, "rb") as f:
+                images.append(f.read())
+    return images
+
+
+def run(mode: str, images: list, batch_size: int) -> list:
+    from inference import OptimizedVLM
+
+    settings.quantization = mode
+    load_start = time.perf_counter()
+    vlm = OptimizedVLM()
+    load_time = time.perf_counter() - load_start
+
+    imgs = [vlm.preprocess_img(b) for b in images]
+    vlm.predict_batch(imgs[:1], [""])  # warm up kernels and the prefix cache
+
+    names = []
+    start = time.perf_counter()
+    for i in range(0, len(imgs), batch_size):
+        batch = imgs[i:i + batch_size]
+        names.extend(vlm.predict_batch(batch, [""] * len(batch)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{mode:>8}: load {load_time:.1f}s, {len(imgs)} images in {elapsed:.1f}s -> "
+          f"{elapsed / len(imgs):.2f}s/image, {len(imgs) / elapsed:.2f} images/sec, "
+          f"RSS {_rss_bytes() / 2**30:.1f}GB")
+    del vlm
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", nargs="?")
+    parser.add_argument("--count", type=int, default=8, help="synthetic images to generate")
+    parser.add_argument("--batch-size", type=int, default=settings.cpu_max_batch_size)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = all cores)")
+    args = parser.parse_args()
+
+    settings.cpu_threads = args.threads
+    settings.result_cache_backend = "none"
+    settings.autotune_on_startup = False
+
+    images = load_images(args.image_dir) if args.image_dir else synthetic_images(args.count)
+    print(f"Naming {len(images)} images with {settings.model_id} on CPU (batch size {args.batch_size})")
+
+    baseline = run("none", images, args.batch_size)
+    quantized = run("int8", images, args.batch_size)
+
+    same = sum(a == b for a, b in zip(baseline, quantized))
+    print(f"int8 names matching float32: {same}/{len(images)}")
+    for a, b in zip(baseline, quantized):
+        if a != b:
+            print(f"  {a}  ->  {b}")
+
+
+if __name__ == "__main__":
+    main()
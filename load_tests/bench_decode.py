@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Decode throughput benchmark: thread pool vs process pool with shared-memory hand-off.
+
+Usage:
+    python3 load_tests/bench_decode.py [image_dir] [--workers N] [--repeat R]
+
+Without an image directory, synthetic 12MP JPEGs and PNGs are generated.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from PIL import Image
+from imaging import ProcessDecoder, decode_image
+
+MAX_PIXELS = 786432
+
+
+def synthetic_images(count: int) -> list:
+    images = []
+    for i in range(count):
+        im = Image.effect_noise((4000, 3000), 64 + i % 64).convert("RGB")
+        bio = io.BytesIO()
+        im.save(bio, "JPEG" if i % 2 == 0 else "PNG")
+        images.append(bio.getvalue())
+    return images
+
+
+def load_images(path: str) -> list:
+    images = []
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            with open(full, "rb") as f:
+                images.append(f.read())
+    return images
+
+
+def run(label: str, decode, images: list, workers: int, repeat: int):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(decode, images[:workers]))  # warm up workers
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(pool.map(decode, images))
+        elapsed = time.perf_counter() - start
+    total = len(images) * repeat
+    print(f"{label:>8}: {total} images in {elapsed:.2f}s -> {total / elapsed:.1f} images/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", nargs="?")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--count", type=int, default=16, help="synthetic images to generate")
+    args = parser.parse_args()
+
+    images = load_images(args.image_dir) if args.image_dir else synthetic_images(args.count)
+    print(f"Decoding {len(images)} images x{args.repeat} with {args.workers} workers")
+
+    run("thread", lambda b: decode_image(b, MAX_PIXELS), images, args.workers, args.repeat)
+
+    decoder = ProcessDecoder(args.workers)
+    try:
+        run("process", lambda b: decoder.decode(b, MAX_PIXELS), images, args.workers, args.repeat)
+    finally:
+        decoder.shutdown()
+
+
+if __name__ == "__main__":
+    main()